@@ -6,66 +6,129 @@ import time
 
 # from elasticsearch import AsyncElasticsearch
 
-from fts_elastic.es_client import get_es_client
-from utils import TERMS, write_to_file
+from fts_elastic.es_client import es_hosts, get_es_client
+from fts_elastic.hedging import get_hedged_client
+from fts_elastic.index_creator import INDEX_ALIAS
+from fts_elastic.msearch import MultiSearchBatcher
+from fts_elastic.search_data import (
+    build_search_body,
+    observe_took,
+    parse_hits,
+    search_keywords_lean,
+    stream_keywords,
+)
+from locales import DEFAULT_LOCALE
+from metrics import span
+from result_writers import write_records
+from utils import TERMS
 
 
 async def search_adwords_keywords(
-    es_client, term, columns, search_type="broad", total_keywords=1000
+    es_client,
+    term,
+    columns,
+    search_type="broad",
+    total_keywords=1000,
+    batcher=None,
+    cache=None,
+    limiter=None,
+    locale=DEFAULT_LOCALE,
 ):
-    if search_type == "phrase":
-        match = {"match_phrase": {"keyword": term}}
-    else:
-        match = {"match": {"keyword": {"query": term, "operator": "and"}}}
-
-    resp = await es_client.search(
-        index="adwords_en_us_2022_12",
-        body={
-            "sort": [{"volume": "desc"}],
-            "query": {
-                "bool": {
-                    "must": [match],
-                    "must_not": [{"exists": {"field": "spell_type"}}],
-                }
-            },
-            "fields": columns,
-            "source": False,
-        },
-        size=total_keywords,
-    )
+    """`locale` (see `locales.locale_for`) picks the adwords_{language}_{country} alias searched."""
+    if cache is not None:
+        return await cache.get_or_fetch(
+            cache.make_key(term, search_type, columns, total_keywords, locale),
+            lambda: search_adwords_keywords(
+                es_client,
+                term,
+                columns,
+                search_type,
+                total_keywords,
+                batcher,
+                limiter=limiter,
+                locale=locale,
+            ),
+        )
+
+    if limiter is not None:
+        async with limiter.slot():
+            return await search_adwords_keywords(
+                es_client, term, columns, search_type, total_keywords, batcher, locale=locale
+            )
 
-    results = []
-    for hit in resp.get("hits", {}).get("hits", []):
-        fields = hit["fields"]
-        results.append({"keyword": fields["keyword"][0], "volume": fields["volume"][0]})
+    body = build_search_body(term, columns, search_type, total_keywords)
+    with span("es.search"):
+        if batcher is not None:
+            resp = await batcher.search(body, index=locale.name)
+        else:
+            resp = await es_client.search(index=locale.name, body=body)
+    observe_took(resp)
 
-    return results
+    with span("es.parse"):
+        return parse_hits(resp)
 
 
-async def run(es_client, terms, search_types, add_suffix, project):
+async def search_adwords_keywords_lean(
+    es_client, term, search_type="broad", total_keywords=1000, locale=DEFAULT_LOCALE
+):
+    return await search_keywords_lean(
+        es_client, term, search_type, total_keywords, index=locale.name
+    )
+
+
+async def stream_adwords_keywords(
+    es_client,
+    term,
+    columns,
+    search_type="broad",
+    page_size=1000,
+    prefetch=True,
+    locale=DEFAULT_LOCALE,
+):
+    async for result in stream_keywords(
+        es_client,
+        term,
+        columns,
+        search_type,
+        page_size=page_size,
+        prefetch=prefetch,
+        locale=locale,
+    ):
+        yield result
+
+
+async def run(es_client, terms, search_types, add_suffix, project, batcher=None):
     for term in terms:
         for search_type in search_types:
             print(f"<<<<<<<<< Search type: {search_type}, term: {term} >>>>>>>>>")
             t1 = time.perf_counter()
             result = await search_adwords_keywords(
-                es_client, term, ["keyword", "volume"], search_type=search_type
+                es_client,
+                term,
+                ["keyword", "volume"],
+                search_type=search_type,
+                batcher=batcher,
             )
             print(f"Time taken, {term}: {time.perf_counter() - t1}")
 
             file_name = f"elastic_local/{project}/{term}_{search_type}" if add_suffix else f"elastic/{project}/{term}"
-            write_to_file(file_name, result)
+            with span("es.write"):
+                await write_records(result, file_name, columns=["keyword", "volume"])
 
 
 async def main(project='papi'):
     search_types = ["phrase", "broad"] if project == 'dapi' else ["broad"]
     add_suffix = project == 'dapi'
 
-    async with get_es_client() as es_client:
-        await asyncio.gather(
-            run(es_client, TERMS["singe_word_terms"], search_types, add_suffix, project),
-            run(es_client, TERMS["two_word_terms"], search_types, add_suffix, project),
-            run(es_client, TERMS["three_word_terms"], search_types, add_suffix, project),
-        )
+    # With several nodes in ELASTICSEARCH_HOSTS, searches are routed and hedged over them
+    get_client = get_hedged_client if len(es_hosts()) > 1 else get_es_client
+    async with get_client() as es_client:
+        async with MultiSearchBatcher(es_client, INDEX_ALIAS) as batcher:
+            await asyncio.gather(
+                run(es_client, TERMS["singe_word_terms"], search_types, add_suffix, project, batcher),
+                run(es_client, TERMS["two_word_terms"], search_types, add_suffix, project, batcher),
+                run(es_client, TERMS["three_word_terms"], search_types, add_suffix, project, batcher),
+            )
 
 
 if __name__ == "__main__":
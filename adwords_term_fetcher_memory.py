@@ -0,0 +1,60 @@
+import asyncio
+import os
+import time
+
+from fts_memory.corpus import load_index
+from result_writers import write_records
+from utils import TERMS
+
+
+async def search_adwords_keywords(
+    index, term, columns, search_type="broad", total_keywords=1000
+):
+    doc_ids = index.search(term, search_type=search_type, total_keywords=total_keywords)
+
+    values = {
+        "keyword": lambda doc_id: index.keywords[doc_id],
+        "volume": lambda doc_id: int(index.volumes[doc_id]),
+    }
+    return [{col: values[col](doc_id) for col in columns} for doc_id in doc_ids]
+
+
+async def suggest_adwords_keywords(autocomplete, prefix, total_keywords=10):
+    return [
+        {"keyword": keyword, "volume": volume}
+        for keyword, volume in autocomplete.suggest(prefix, total_keywords)
+    ]
+
+
+async def run(index, terms, search_types, add_suffix, project):
+    for term in terms:
+        for search_type in search_types:
+            print(f"<<<<<<<<< Search type: {search_type}, term: {term} >>>>>>>>>")
+            t1 = time.perf_counter()
+            result = await search_adwords_keywords(
+                index, term, ["keyword", "volume"], search_type=search_type
+            )
+            print(f"Time taken, {term}: {time.perf_counter() - t1}")
+
+            file_name = f"memory/{project}/{term}_{search_type}" if add_suffix else f"memory/{project}/{term}"
+            await write_records(result, file_name, columns=["keyword", "volume"])
+
+
+async def main(project='papi'):
+    search_types = ["phrase", "broad"] if project == 'dapi' else ["broad"]
+    add_suffix = project == 'dapi'
+
+    t1 = time.perf_counter()
+    index = load_index()
+    print(f"Loaded {len(index)} keywords in {time.perf_counter() - t1}")
+
+    os.makedirs(os.path.join(os.path.dirname(__file__), f"memory/{project}"), exist_ok=True)
+    await asyncio.gather(
+        run(index, TERMS["singe_word_terms"], search_types, add_suffix, project),
+        run(index, TERMS["two_word_terms"], search_types, add_suffix, project),
+        run(index, TERMS["three_word_terms"], search_types, add_suffix, project),
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,88 +1,212 @@
 import asyncio
 import os
 import time
-from contextlib import asynccontextmanager
 
-from dotenv import load_dotenv
+from fts_postgres.pg_client import acquire, get_pg_pool
+from fts_postgres.queries import (
+    fetch_keywords_page,
+    search_keywords,
+    search_keywords_batch,
+    stream_keywords,
+)
+from fts_postgres.shards import get_sharded_pool, merge_sorted, merge_top, shard_columns
+from fts_postgres.top_keywords import search_top_keywords
+from locales import DEFAULT_LOCALE
+from metrics import span
+from result_writers import write_records
+from utils import TERMS
 
-import asyncpg
 
-from utils import TERMS, write_to_file
+async def search_adwords_keywords(
+    pool,
+    term,
+    columns,
+    search_type="broad",
+    total_keywords=1000,
+    cache=None,
+    limiter=None,
+    locale=DEFAULT_LOCALE,
+):
+    """
+    With a `concurrency.ConcurrencyLimiter`, searches over its limit wait for a
+    slot instead of queueing on the pool, size the pool to its `max_limit`.
 
-dotenv_path = os.path.join(os.path.dirname(__file__), ".env")
-load_dotenv(dotenv_path)
+    `locale` (see `locales.locale_for`) picks the adwords_{language}_{country}
+    table searched.
+    """
+    if cache is not None:
+        return await cache.get_or_fetch(
+            cache.make_key(term, search_type, columns, total_keywords, locale),
+            lambda: search_adwords_keywords(
+                pool, term, columns, search_type, total_keywords, limiter=limiter, locale=locale
+            ),
+        )
 
+    if limiter is not None:
+        async with limiter.slot():
+            return await search_adwords_keywords(
+                pool, term, columns, search_type, total_keywords, locale=locale
+            )
 
-db_params = {
-    "user": os.getenv("DB_USER"),
-    "password": os.getenv("DB_PASSWORD"),
-    "database": os.getenv("DB_NAME"),
-    "host": os.getenv("DB_HOST"),
-    "port": os.getenv("DB_PORT"),
-}
+    async with acquire(pool) as conn:
+        with span("pg.query"):
+            result = await search_connection(
+                conn, term, columns, search_type, total_keywords, locale
+            )
 
+    with span("pg.build_dicts"):
+        return [{col: r[col] for col in columns} for r in result]
 
-@asynccontextmanager
-async def db_connection(**kwargs):
-    conn = await asyncpg.connect(
-        user=kwargs.get("user"),
-        password=kwargs.get("password"),
-        database=kwargs.get("database"),
-        host=kwargs.get("host"),
-        port=kwargs.get("port"),
-    )
-    yield conn
-    await conn.close()
 
+async def search_connection(
+    conn, term, columns, search_type, total_keywords, locale=DEFAULT_LOCALE
+):
+    # Top keywords are only kept for the default locale
+    result = None
+    if locale == DEFAULT_LOCALE:
+        result = await search_top_keywords(conn, term, columns, search_type, total_keywords)
+    if result is None:
+        result = await search_keywords(
+            conn, term, columns, search_type, total_keywords, locale=locale
+        )
 
-async def search_adwords_keywords(
-    pool, term, columns, search_type="broad", total_keywords=1000
+    return result
+
+
+async def search_adwords_keywords_sharded(
+    sharded_pool, term, columns, search_type="broad", total_keywords=1000
 ):
-    separator = {"phrase": "<->", "broad": "&"}[search_type]
-    q = f"{separator}".join(term.split(" "))
-
-    search_query = f"""
-        with matched_keywrods as (
-            select *
-            from adwords_en_us
-            where keyword_tsv @@ to_tsquery('{q}')
+    """Every shard returns its local top k by volume, merged into the global top k."""
+    with span("pg.shards.query"):
+        results = await sharded_pool.run(
+            search_connection, term, shard_columns(columns), search_type, total_keywords
         )
-        select {', '.join(columns)}
-        from matched_keywrods
-        where spell_type is null
-        order by volume desc
-        limit {total_keywords};
-    """
 
-    async with pool.acquire() as conn:
-        result = await conn.fetch(search_query)
+    with span("pg.shards.merge"):
+        return [{col: r[col] for col in columns} for r in merge_top(results, total_keywords)]
 
-    return [{col: r[col] for col in columns} for r in result]
 
+async def stream_adwords_keywords_sharded(
+    sharded_pool, term, columns, search_type="broad", batch_size=1000
+):
+    shard_streams = sharded_pool.iterate(
+        stream_keywords, term, shard_columns(columns), search_type, batch_size
+    )
+    async for rows in merge_sorted(shard_streams, batch_size=batch_size):
+        yield [{col: r[col] for col in columns} for r in rows]
+
+
+async def search_adwords_keywords_batch(
+    pool,
+    terms,
+    columns,
+    search_type="broad",
+    total_keywords=1000,
+    limiter=None,
+    locale=DEFAULT_LOCALE,
+):
+    """All the `terms` are searched in the one `locale` table."""
+    if limiter is not None:
+        async with limiter.slot():
+            return await search_adwords_keywords_batch(
+                pool, terms, columns, search_type, total_keywords, locale=locale
+            )
 
-async def run(terms, search_types, add_suffix, project):
+    async with acquire(pool) as conn:
+        with span("pg.query_batch"):
+            results = await search_keywords_batch(
+                conn, terms, columns, search_type, total_keywords, locale=locale
+            )
+
+    with span("pg.build_dicts"):
+        return {
+            term: [{col: r[col] for col in columns} for r in result]
+            for term, result in results.items()
+        }
+
+
+async def stream_adwords_keywords(
+    pool, term, columns, search_type="broad", batch_size=1000, locale=DEFAULT_LOCALE
+):
+    async with acquire(pool) as conn:
+        async for rows in stream_keywords(
+            conn, term, columns, search_type, batch_size, locale=locale
+        ):
+            yield [{col: r[col] for col in columns} for r in rows]
+
+
+async def fetch_adwords_keywords_page(
+    pool, term, columns, search_type="broad", page_size=1000, after=None, locale=DEFAULT_LOCALE
+):
+    async with acquire(pool) as conn:
+        with span("pg.query_page"):
+            rows, next_after = await fetch_keywords_page(
+                conn, term, columns, search_type, page_size, after, locale=locale
+            )
+
+    return [{col: r[col] for col in columns} for r in rows], next_after
+
+
+async def run(pool, terms, search_types, add_suffix, project, search=search_adwords_keywords):
     for term in terms:
         for search_type in search_types:
             print(f"<<<<<<<<< Search type: {search_type}, term: {term} >>>>>>>>>")
             t1 = time.perf_counter()
-            result = await search_adwords_keywords(
-                term, ["keyword", "volume"], search_type=search_type
+            result = await search(
+                pool, term, ["keyword", "volume"], search_type=search_type
             )
             print(f"Time taken, {term}: {time.perf_counter() - t1}")
 
             file_name = f"postgres/{project}/{term}_{search_type}" if add_suffix else f"postgres/{project}/{term}"
-            write_to_file(file_name, result)
+            with span("pg.write"):
+                await write_records(result, file_name, columns=["keyword", "volume"])
+
+
+async def run_batch(pool, terms, search_types, add_suffix, project):
+    for search_type in search_types:
+        print(f"<<<<<<<<< Search type: {search_type}, terms: {len(terms)} >>>>>>>>>")
+        t1 = time.perf_counter()
+        results = await search_adwords_keywords_batch(
+            pool, terms, ["keyword", "volume"], search_type=search_type
+        )
+        print(f"Time taken, {len(terms)} terms: {time.perf_counter() - t1}")
+
+        await asyncio.gather(
+            *[
+                write_records(
+                    result,
+                    f"postgres/{project}/{term}_{search_type}" if add_suffix else f"postgres/{project}/{term}",
+                    columns=["keyword", "volume"],
+                )
+                for term, result in results.items()
+            ]
+        )
 
 
 async def main(project='papi'):
     search_types = ["phrase", "broad"] if project == 'dapi' else ["broad"]
     add_suffix = project == 'dapi'
 
-    await asyncio.gather(
-        run(TERMS["singe_word_terms"], search_types, add_suffix, project),
-        run(TERMS["two_word_terms"], search_types, add_suffix, project),
-        run(TERMS["three_word_terms"], search_types, add_suffix, project),
-    )
+    if os.getenv("DB_SHARDS"):
+        async with get_sharded_pool(min_size=1, max_size=1) as sharded_pool:
+            await run(
+                sharded_pool,
+                [term for terms in TERMS.values() for term in terms],
+                search_types,
+                add_suffix,
+                project,
+                search=search_adwords_keywords_sharded,
+            )
+        return
+
+    async with get_pg_pool(min_size=1, max_size=1) as pool:
+        await run_batch(
+            pool,
+            [term for terms in TERMS.values() for term in terms],
+            search_types,
+            add_suffix,
+            project,
+        )
 
 
 if __name__ == "__main__":
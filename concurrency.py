@@ -0,0 +1,139 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+from histogram import LatencyHistogram
+from metrics import METRICS
+
+
+class ConcurrencyLimiter:
+    """
+    AIMD limit on the requests in flight. Every `window_size` completed
+    requests the window's p99 latency and error rate are checked: over
+    `target_p99` or `max_error_rate` the limit is cut by `backoff`, otherwise
+    it grows by one, if the window actually reached the limit. Callers over
+    the limit wait in `acquire`, so a slow backend gets fewer requests
+    instead of a growing queue.
+    """
+
+    def __init__(
+        self,
+        initial_limit=10,
+        min_limit=1,
+        max_limit=1000,
+        target_p99=0.1,
+        max_error_rate=0.01,
+        backoff=0.9,
+        window_size=100,
+        name="default",
+    ):
+        self.limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_p99 = target_p99
+        self.max_error_rate = max_error_rate
+        self.backoff = backoff
+        self.window_size = window_size
+        self.name = name
+
+        self.in_flight = 0
+        self.history = []
+
+        self._waiters = deque()
+        self._new_window()
+
+        METRICS.register_gauge("concurrency.limit", lambda: self.limit, limiter=name)
+        METRICS.register_gauge("concurrency.in_flight", lambda: self.in_flight, limiter=name)
+        METRICS.register_gauge("concurrency.waiting", lambda: len(self._waiters), limiter=name)
+
+    def _new_window(self):
+        self._window = LatencyHistogram()
+        self._window_errors = 0
+        self._window_peak = self.in_flight
+        self._window_started_at = time.perf_counter()
+
+    async def acquire(self):
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.append(future)
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # Woken up with a slot already counted for it
+                    self.in_flight -= 1
+                    self._wake()
+                else:
+                    self._waiters.remove(future)
+                raise
+        self._window_peak = max(self._window_peak, self.in_flight)
+
+    def release(self, latency, is_error=False):
+        self.in_flight -= 1
+        if is_error:
+            self._window_errors += 1
+        else:
+            self._window.record(latency)
+
+        if self._window.count + self._window_errors >= self.window_size:
+            self._adjust()
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self.in_flight < self.limit:
+            future = self._waiters.popleft()
+            if not future.done():
+                self.in_flight += 1
+                future.set_result(None)
+
+    def _adjust(self):
+        completed = self._window.count + self._window_errors
+        elapsed = time.perf_counter() - self._window_started_at
+        p99 = (self._window.percentile(99) or 0) / 1_000_000
+        error_rate = self._window_errors / completed
+        limit = self.limit
+
+        if p99 > self.target_p99 or error_rate > self.max_error_rate:
+            self.limit = max(self.min_limit, int(self.limit * self.backoff))
+        elif self._window_peak >= self.limit:
+            self.limit = min(self.max_limit, self.limit + 1)
+
+        self.history.append(
+            {
+                "limit": limit,
+                "peak_in_flight": self._window_peak,
+                "completed": completed,
+                "qps": completed / max(elapsed, 1e-9),
+                "p99_ms": p99 * 1000,
+                "error_rate": error_rate,
+            }
+        )
+        self._new_window()
+
+    @asynccontextmanager
+    async def slot(self):
+        """Holds a slot for the block, an exception counts as an error."""
+        await self.acquire()
+        started_at = time.perf_counter()
+        is_error = True
+        try:
+            yield
+            is_error = False
+        finally:
+            self.release(time.perf_counter() - started_at, is_error)
+
+    def max_sustainable(self):
+        """The window with the highest throughput that met the p99 and error targets."""
+        healthy = [
+            window
+            for window in self.history
+            if window["p99_ms"] <= self.target_p99 * 1000
+            and window["error_rate"] <= self.max_error_rate
+        ]
+        return max(healthy, key=lambda window: window["qps"], default=None)
+
+    def close(self):
+        METRICS.unregister_gauges(limiter=self.name)
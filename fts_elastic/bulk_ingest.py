@@ -1,49 +1,179 @@
 import asyncio
 import csv
+import hashlib
+import itertools
+import json
 import os.path
+import time
+from contextlib import asynccontextmanager
 from pathlib import Path
 
-from elasticsearch.helpers import async_bulk
+from elasticsearch.helpers import async_streaming_bulk
 
 from fts_elastic.es_client import get_es_client
-from fts_elastic.index_creator import create_index
+from fts_elastic.index_creator import (
+    create_index,
+    get_alias_index,
+    index_name_for,
+    swap_alias,
+)
+from locales import DEFAULT_LOCALE
 
 
-def generate_actions(file_path, index_name):
+def keyword_id(keyword):
+    """Document id of a keyword, the same in every monthly index."""
+    return hashlib.blake2b(keyword.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def content_hash(doc):
+    return hashlib.blake2b(
+        json.dumps(doc, sort_keys=True).encode("utf-8"), digest_size=16
+    ).hexdigest()
+
+
+def read_docs(file_path):
+    """(id, doc) of every csv row, `doc` being the indexed fields without the hash."""
     with open(file_path, mode="r") as f:
         reader = csv.DictReader(f)
 
         for row in reader:
             doc = {
                 "keyword": row["keyword"],
-                "volume": row["volume"],
+                "volume": int(row["volume"]),
             }
+            yield keyword_id(doc["keyword"]), doc
+
+
+def generate_actions(file_path, index_name, only_ids=None):
+    """Index actions for the csv rows, only for the ids in `only_ids` when given."""
+    for doc_id, doc in read_docs(file_path):
+        if only_ids is not None and doc_id not in only_ids:
+            continue
+
+        yield {
+            "_index": index_name,
+            "_id": doc_id,
+            "_source": {**doc, "content_hash": content_hash(doc)},
+        }
+
+
+async def get_load_settings(es, index_name):
+    resp = await es.indices.get_settings(index=index_name)
+    settings = resp[index_name]["settings"]["index"]
+    return {
+        "refresh_interval": settings.get("refresh_interval"),
+        "number_of_replicas": settings.get("number_of_replicas"),
+    }
+
+
+async def put_load_settings(es, index_name, settings):
+    await es.indices.put_settings(index=index_name, body={"index": settings})
+
+
+async def bulk_stream(es, actions, stats, chunk_size, max_chunk_bytes, max_retries):
+    """One bulk request in flight at a time, 429 rejections are retried with backoff."""
+    async for ok, item in async_streaming_bulk(
+        es,
+        actions,
+        chunk_size=chunk_size,
+        max_chunk_bytes=max_chunk_bytes,
+        max_retries=max_retries,
+        initial_backoff=2,
+        max_backoff=60,
+        raise_on_error=False,
+    ):
+        if ok:
+            stats["indexed"] += 1
+        else:
+            stats["failed"] += 1
+            print("Failed to index", item)
 
-            yield {
-                "_index": index_name,
-                "_source": doc,
-            }
 
+async def report(stats, started_at, interval=5):
+    while True:
+        await asyncio.sleep(interval)
+        docs_per_sec = stats["indexed"] / (time.perf_counter() - started_at)
+        print(f"Indexed {stats['indexed']} documents, {docs_per_sec:.0f} docs/sec")
 
-async def main(index_name="adwords_en_us_2022_12"):
+
+@asynccontextmanager
+async def load_settings(es, index_name):
+    """Refresh and replicas are turned off inside the block, then restored."""
+    original_settings = await get_load_settings(es, index_name)
+    await put_load_settings(
+        es, index_name, {"refresh_interval": "-1", "number_of_replicas": 0}
+    )
+    try:
+        yield
+    finally:
+        await put_load_settings(es, index_name, original_settings)
+
+
+async def bulk_load(
+    es,
+    actions,
+    streams=4,
+    chunk_size=1000,
+    max_chunk_bytes=10 * 1024 * 1024,
+    max_retries=5,
+):
+    """Sends the actions over `streams` concurrent bulk streams."""
+    stats = {"indexed": 0, "failed": 0}
+    started_at = time.perf_counter()
+    reporter = asyncio.create_task(report(stats, started_at))
+    try:
+        await asyncio.gather(
+            *[
+                bulk_stream(es, actions, stats, chunk_size, max_chunk_bytes, max_retries)
+                for _ in range(streams)
+            ]
+        )
+    finally:
+        reporter.cancel()
+
+    docs_per_sec = stats["indexed"] / (time.perf_counter() - started_at)
+    print(f"Indexed {stats['indexed']} documents, {docs_per_sec:.0f} docs/sec, failed {stats['failed']}")
+
+    return stats
+
+
+async def ingest(es, file_paths, index_name, only_ids=None, **kwargs):
+    """
+    Indexes the files over concurrent bulk streams (see `bulk_load`). Refresh
+    and replicas are turned off for the load, then restored and the index is
+    force merged.
+    """
+    actions = itertools.chain.from_iterable(
+        generate_actions(file_path, index_name, only_ids) for file_path in file_paths
+    )
+    async with load_settings(es, index_name):
+        stats = await bulk_load(es, actions, **kwargs)
+
+    await es.indices.refresh(index=index_name)
+    await es.indices.forcemerge(index=index_name, max_num_segments=1)
+
+    return stats
+
+
+async def main(index_name=None, locale=DEFAULT_LOCALE):
+    index_name = index_name or index_name_for(locale=locale)
     print("Indexing documents...")
     folder_path = os.path.join(Path(__file__).parent.parent, "postgres/papi")
 
-    docs_inserted = 0
     async with get_es_client() as es:
-        should_create_index = not es.indices.exists(index_name)
+        should_create_index = not await es.indices.exists(index=index_name)
         if should_create_index:
-            await create_index(es, index_name)
-
-        for file in os.listdir(folder_path):
-            file_path = f'{folder_path}/{file}'
-
-            print("file_path", file_path)
+            await create_index(es, index_name, locale)
 
-            success_docs, failed_docs = await async_bulk(es, actions=generate_actions(file_path, index_name), chunk_size=1000, raise_on_error=True)
-            docs_inserted += success_docs
+        file_paths = [f"{folder_path}/{file}" for file in os.listdir(folder_path)]
+        stats = await ingest(es, file_paths, index_name)
+        print(f"Indexed {stats['indexed']} documents")
 
-        print(f"Indexed {docs_inserted} documents")
+        # Every keyword was indexed, so the alias can serve the new index
+        previous_index = await get_alias_index(es, locale.name)
+        if previous_index != index_name:
+            await swap_alias(es, index_name, previous_index, locale.name)
+            print(f"Pointed {locale.name} at {index_name}, was {previous_index}")
 
 
 if __name__ == "__main__":
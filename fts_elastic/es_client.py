@@ -4,6 +4,12 @@ from pathlib import Path
 
 from dotenv import load_dotenv
 from elasticsearch import AsyncElasticsearch
+from elasticsearch.serializer import JSONSerializer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 dotenv_path = os.path.join(Path(__file__).parent.parent, ".env")
 print("do", dotenv_path)
@@ -13,16 +19,42 @@ ELASTICSEARCH_HOST = os.getenv("ELASTICSEARCH_HOST")
 ELASTICSEARCH_PORT = os.getenv("ELASTICSEARCH_PORT")
 ELASTICSEARCH_USER = os.getenv("ELASTICSEARCH_USER")
 ELASTICSEARCH_PASSWORD = os.getenv("ELASTICSEARCH_PASSWORD")
+# Comma separated host:port list of the nodes to spread searches over
+ELASTICSEARCH_HOSTS = os.getenv("ELASTICSEARCH_HOSTS")
 
 
-@asynccontextmanager
-async def get_es_client():
-    client = AsyncElasticsearch(
-        hosts=[f"http://{ELASTICSEARCH_HOST}:{ELASTICSEARCH_PORT}"],
+def es_hosts():
+    if ELASTICSEARCH_HOSTS:
+        return [f"http://{host.strip()}" for host in ELASTICSEARCH_HOSTS.split(",")]
+    return [f"http://{ELASTICSEARCH_HOST}:{ELASTICSEARCH_PORT}"]
+
+
+class OrjsonSerializer(JSONSerializer):
+    def loads(self, s):
+        return orjson.loads(s)
+
+    def dumps(self, data):
+        if isinstance(data, str):
+            return data
+        return orjson.dumps(data, default=self.default).decode("utf-8")
+
+
+def create_es_client(hosts=None, **kwargs):
+    if orjson is not None:
+        kwargs.setdefault("serializer", OrjsonSerializer())
+
+    return AsyncElasticsearch(
+        hosts=hosts or [f"http://{ELASTICSEARCH_HOST}:{ELASTICSEARCH_PORT}"],
         verify_certs=False,
         http_auth=(ELASTICSEARCH_USER, ELASTICSEARCH_PASSWORD),
+        **kwargs,
     )
 
+
+@asynccontextmanager
+async def get_es_client(**kwargs):
+    client = create_es_client(**kwargs)
+
     yield client
 
     await client.close()
@@ -0,0 +1,280 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+from elasticsearch.exceptions import ConnectionError as ESConnectionError
+from elasticsearch.exceptions import TransportError
+
+from fts_elastic.es_client import create_es_client, es_hosts
+from histogram import LatencyHistogram
+from metrics import METRICS
+
+
+class NoNodeAvailable(Exception):
+    pass
+
+
+def is_node_failure(error):
+    """Errors caused by the node rather than the request, they count against its breaker."""
+    if isinstance(error, (ESConnectionError, asyncio.TimeoutError)):
+        return True
+    if isinstance(error, TransportError) and isinstance(error.status_code, int):
+        return error.status_code >= 500 or error.status_code == 429
+    return False
+
+
+class Node:
+    """
+    One elasticsearch node, with a latency ewma for routing and a circuit
+    breaker: `failure_threshold` consecutive failures open it for
+    `reset_timeout` seconds, then a single probe request decides whether it
+    closes again.
+    """
+
+    def __init__(self, name, client, alpha=0.2, failure_threshold=5, reset_timeout=10):
+        self.name = name
+        self.client = client
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.ewma = None
+        self.in_flight = 0
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def is_available(self):
+        state = self.state
+        return state == "closed" or (state == "half_open" and not self.probing)
+
+    def score(self, default_latency):
+        """Expected wait, the latency ewma scaled by the requests already in flight."""
+        latency = self.ewma if self.ewma is not None else default_latency
+        return latency * (self.in_flight + 1), self.in_flight
+
+    def record_success(self, latency):
+        self.ewma = latency if self.ewma is None else self.alpha * latency + (1 - self.alpha) * self.ewma
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.probing or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self.probing = False
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "state": self.state,
+            "ewma_ms": None if self.ewma is None else self.ewma * 1000,
+            "in_flight": self.in_flight,
+            "failures": self.failures,
+        }
+
+
+class HedgedClient:
+    """
+    Sends `search`/`msearch` to the node with the lowest expected latency.
+    With `hedge`, a request still running after the `hedge_percentile` latency
+    of the last `window_size` requests is sent to a second node as well, the
+    first response wins and the other request is cancelled. Hedges are capped
+    at `max_hedge_ratio` of the requests, so a slow cluster doesn't get twice
+    the load. A node failure fails over to the nodes not tried yet.
+
+    Any other client method or namespace (`open_point_in_time`, `indices`...)
+    is forwarded to the best available node, without hedging or failover.
+    """
+
+    def __init__(
+        self,
+        clients,
+        hedge=True,
+        hedge_percentile=95,
+        initial_hedge_delay=0.05,
+        window_size=1000,
+        max_hedge_ratio=0.1,
+        **node_kwargs,
+    ):
+        self.nodes = [Node(name, client, **node_kwargs) for name, client in clients.items()]
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_delay = initial_hedge_delay
+        self.window_size = window_size
+        self.max_hedge_ratio = max_hedge_ratio
+        self.stats = {"requests": 0, "hedged": 0, "hedge_wins": 0, "failovers": 0}
+
+        self._window = LatencyHistogram()
+        self._register_gauges()
+
+    def _register_gauges(self):
+        for node in self.nodes:
+            labels = {"client": "hedged", "node": node.name}
+            METRICS.register_gauge("es.node.in_flight", lambda n=node: n.in_flight, **labels)
+            METRICS.register_gauge("es.node.ewma_seconds", lambda n=node: n.ewma or 0.0, **labels)
+            METRICS.register_gauge(
+                "es.node.breaker_open", lambda n=node: int(n.state == "open"), **labels
+            )
+        for stat in self.stats:
+            METRICS.register_gauge(f"es.hedging.{stat}", lambda s=stat: self.stats[s], client="hedged")
+        METRICS.register_gauge("es.hedging.delay_seconds", lambda: self.hedge_delay, client="hedged")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def pick(self, exclude=()):
+        candidates = [n for n in self.nodes if n not in exclude and n.is_available()]
+        if not candidates:
+            return None
+
+        # Nodes without a measurement yet are expected to be as fast as the others
+        measured = [n.ewma for n in self.nodes if n.ewma is not None]
+        default_latency = sum(measured) / len(measured) if measured else 0.0
+        return min(candidates, key=lambda n: n.score(default_latency))
+
+    def _record(self, latency):
+        self._window.record(latency)
+        if self._window.count >= self.window_size:
+            self.hedge_delay = self._window.percentile(self.hedge_percentile) / 1_000_000
+            self._window = LatencyHistogram()
+
+    def _can_hedge(self):
+        return (
+            self.hedge
+            and len(self.nodes) > 1
+            and self.stats["hedged"] < self.max_hedge_ratio * self.stats["requests"]
+        )
+
+    async def _call(self, node, method, kwargs):
+        if node.state == "half_open":
+            node.probing = True
+        node.in_flight += 1
+        t1 = time.perf_counter()
+        try:
+            resp = await getattr(node.client, method)(**kwargs)
+        except asyncio.CancelledError:
+            node.probing = False
+            raise
+        except Exception as error:
+            if is_node_failure(error):
+                node.record_failure()
+            else:
+                node.probing = False
+            raise
+        finally:
+            node.in_flight -= 1
+
+        latency = time.perf_counter() - t1
+        node.record_success(latency)
+        self._record(latency)
+        return resp
+
+    async def _request(self, method, **kwargs):
+        self.stats["requests"] += 1
+        primary = self.pick()
+        if primary is None:
+            raise NoNodeAvailable("The circuit breaker of every node is open")
+
+        loop = asyncio.get_running_loop()
+        tasks = {}
+        tried = []
+        hedge = None
+
+        def _launch(node):
+            tried.append(node)
+            tasks[asyncio.create_task(self._call(node, method, kwargs))] = node
+
+        _launch(primary)
+        hedge_at = loop.time() + self.hedge_delay if self._can_hedge() else None
+        try:
+            while tasks:
+                timeout = None if hedge_at is None else max(hedge_at - loop.time(), 0)
+                done, _ = await asyncio.wait(
+                    tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    hedge_at = None
+                    hedge = self.pick(exclude=tried)
+                    if hedge is not None:
+                        self.stats["hedged"] += 1
+                        _launch(hedge)
+                    continue
+
+                error = None
+                for task in done:
+                    node = tasks.pop(task)
+                    if task.exception() is None:
+                        if node is hedge:
+                            self.stats["hedge_wins"] += 1
+                        return task.result()
+                    error = task.exception()
+                    if not is_node_failure(error):
+                        raise error
+
+                if not tasks:
+                    hedge_at = None
+                    node = self.pick(exclude=tried)
+                    if node is None:
+                        raise error
+                    self.stats["failovers"] += 1
+                    _launch(node)
+        finally:
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+    def __getattr__(self, name):
+        if name.startswith("_") or "nodes" not in self.__dict__:
+            raise AttributeError(name)
+        node = self.pick()
+        if node is None:
+            raise NoNodeAvailable("The circuit breaker of every node is open")
+        return getattr(node.client, name)
+
+    async def search(self, **kwargs):
+        return await self._request("search", **kwargs)
+
+    async def msearch(self, **kwargs):
+        return await self._request("msearch", **kwargs)
+
+    def node_stats(self):
+        return [node.to_dict() for node in self.nodes]
+
+    async def close(self):
+        METRICS.unregister_gauges(client="hedged")
+        await asyncio.gather(*[node.client.close() for node in self.nodes])
+
+
+def create_hedged_client(hosts=None, client_kwargs=None, **kwargs):
+    """
+    One client per node of `hosts` (ELASTICSEARCH_HOSTS by default). The
+    clients don't retry, failing over is left to the hedged client.
+    """
+    client_kwargs = {"max_retries": 0, **(client_kwargs or {})}
+    return HedgedClient(
+        {host: create_es_client(hosts=[host], **client_kwargs) for host in hosts or es_hosts()},
+        **kwargs,
+    )
+
+
+@asynccontextmanager
+async def get_hedged_client(hosts=None, client_kwargs=None, **kwargs):
+    client = create_hedged_client(hosts, client_kwargs, **kwargs)
+
+    yield client
+
+    await client.close()
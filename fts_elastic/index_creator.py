@@ -1,47 +1,102 @@
 import asyncio
+import copy
+from datetime import date
 
 from fts_elastic.es_client import get_es_client
+from locales import DEFAULT_LOCALE
+
+# Searches go through the locale's alias, it points at one monthly index at a time
+INDEX_ALIAS = DEFAULT_LOCALE.name
+
+# Longest prefix indexed in `keyword.prefix`
+PREFIX_MAX_GRAM = 30
 
 INDEX_MAPPING = {
     "settings": {
         "number_of_replicas": 1,
         "number_of_shards": 10,
         "index": {"sort.field": "volume", "sort.order": "desc"},
+        "analysis": {
+            "filter": {
+                "keyword_prefix": {"type": "edge_ngram", "min_gram": 1, "max_gram": PREFIX_MAX_GRAM},
+            },
+            "analyzer": {
+                # Every prefix of the whole keyword, for autocomplete
+                "keyword_prefix": {
+                    "tokenizer": "keyword",
+                    "filter": ["lowercase", "keyword_prefix"],
+                },
+                "keyword_prefix_search": {"tokenizer": "keyword", "filter": ["lowercase"]},
+            },
+        },
     },
     "mappings": {
         "dynamic": False,
         "properties": {
-            "keyword": {"type": "text"},
+            "keyword": {
+                "type": "text",
+                "analyzer": "english",
+                "fields": {
+                    # Doc values, so hits can be read without _source
+                    "raw": {"type": "keyword"},
+                    "prefix": {
+                        "type": "text",
+                        "analyzer": "keyword_prefix",
+                        "search_analyzer": "keyword_prefix_search",
+                        "index_options": "docs",
+                        "norms": False,
+                    },
+                },
+            },
             "volume": {"type": "long"},
+            # Hash of the indexed document, compared by the monthly rollover
+            "content_hash": {"type": "keyword", "index": False},
         },
     },
 }
 
 
-async def create_index(es_client, index_name):
+def index_mapping(locale=DEFAULT_LOCALE):
+    """INDEX_MAPPING with the keyword analyzed in the locale's language."""
+    mapping = copy.deepcopy(INDEX_MAPPING)
+    mapping["mappings"]["properties"]["keyword"]["analyzer"] = locale.analyzer
+    return mapping
+
+
+def index_name_for(day=None, locale=DEFAULT_LOCALE):
+    """Monthly index name of the locale, e.g. adwords_en_us_2022_12."""
+    day = day or date.today()
+    return f"{locale.name}_{day.year}_{day.month:02d}"
+
+
+async def create_index(es_client, index_name, locale=DEFAULT_LOCALE):
     """Creates an index in Elasticsearch if one isn't already there."""
     await es_client.indices.create(
         index=index_name,
-        mappings={
-            "dynamic": False,
-            "properties": {
-                "keyword": {"type": "text", "analyzer": "english"},
-                "volume": {"type": "long"},
-            },
-        },
-        settings={
-            "number_of_replicas": 1,
-            "number_of_shards": 10,
-            "index": {"sort.field": "volume", "sort.order": "desc"},
-        },
+        body=index_mapping(locale),
         # ignore=400,
     )
 
 
+async def get_alias_index(es_client, alias=INDEX_ALIAS):
+    """The index the alias points at, None when there's no alias yet."""
+    if not await es_client.indices.exists_alias(name=alias):
+        return None
+    return next(iter(await es_client.indices.get_alias(name=alias)))
+
+
+async def swap_alias(es_client, new_index, previous_index, alias=INDEX_ALIAS):
+    """Points the alias at the new index in one atomic update."""
+    actions = [{"add": {"index": new_index, "alias": alias}}]
+    if previous_index is not None:
+        actions.insert(0, {"remove": {"index": previous_index, "alias": alias}})
+    await es_client.indices.update_aliases(body={"actions": actions})
+
+
 async def main():
     async with get_es_client() as es_client:
-        await create_index(es_client, 'adwords_en_us_2022_12')
-        # r = await es_client.indices.delete(index='adwords_en_us_2022_12')
+        await create_index(es_client, index_name_for())
+        # r = await es_client.indices.delete(index=index_name_for())
         # print(r)
 
 
@@ -0,0 +1,87 @@
+import asyncio
+import time
+
+from metrics import METRICS, span
+
+
+class MultiSearchError(Exception):
+    pass
+
+
+class MultiSearchBatcher:
+    """
+    Groups concurrent searches into `_msearch` requests. A batch is sent once
+    `batch_size` searches are pending or `max_wait` seconds after the first one,
+    and each response is handed back to the caller that queued it.
+    """
+
+    def __init__(self, es_client, index, batch_size=50, max_wait=0.005):
+        self.es_client = es_client
+        self.index = index
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+
+        self._pending = []
+        self._timer = None
+        self._in_flight = set()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def search(self, body, index=None):
+        """`index` overrides the batcher's one for this search, e.g. another locale's alias."""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((body, index or self.index, future, time.perf_counter()))
+
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+
+        task = asyncio.create_task(self._send(batch))
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+
+    async def _send(self, batch):
+        body = []
+        sent_at = time.perf_counter()
+        for search_body, index, _, queued_at in batch:
+            METRICS.observe("es.msearch.queue", sent_at - queued_at)
+            body.append({"index": index})
+            body.append(search_body)
+
+        try:
+            with span("es.msearch"):
+                resp = await self.es_client.msearch(body=body)
+        except Exception as error:
+            for _, _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+
+        for (_, _, future, _), response in zip(batch, resp["responses"]):
+            if future.done():
+                continue
+            if "error" in response:
+                future.set_exception(MultiSearchError(response["error"]))
+            else:
+                future.set_result(response)
+
+    async def close(self):
+        self._flush()
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight)
@@ -0,0 +1,263 @@
+import argparse
+import asyncio
+import itertools
+import os
+import time
+from datetime import date
+from pathlib import Path
+
+from fts_elastic.bulk_ingest import (
+    bulk_load,
+    content_hash,
+    generate_actions,
+    ingest,
+    load_settings,
+    read_docs,
+)
+from fts_elastic.es_client import get_es_client
+from fts_elastic.index_creator import (
+    INDEX_ALIAS,
+    create_index,
+    get_alias_index,
+    index_name_for,
+    swap_alias,
+)
+from fts_elastic.search_data import search_keywords_lean
+from locales import DEFAULT_LOCALE, locale_for
+from utils import TERMS
+
+
+async def has_content_hash(es, index_name):
+    mapping = await es.indices.get_mapping(index=index_name)
+    return "content_hash" in mapping[index_name]["mappings"].get("properties", {})
+
+
+def read_hashes(file_paths):
+    """Content hash of every keyword of the csv files, by document id."""
+    return {
+        doc_id: content_hash(doc)
+        for file_path in file_paths
+        for doc_id, doc in read_docs(file_path)
+    }
+
+
+async def iterate_hashes(es, index_name, page_size=10000, keep_alive="2m"):
+    """Yields (id, content_hash) of every document, from doc values only."""
+    pit = await es.open_point_in_time(index=index_name, keep_alive=keep_alive)
+    pit_id = pit["id"]
+    search_after = None
+    try:
+        while True:
+            body = {
+                "size": page_size,
+                "sort": ["_shard_doc"],
+                "_source": False,
+                "docvalue_fields": ["content_hash"],
+                "track_total_hits": False,
+                "pit": {"id": pit_id, "keep_alive": keep_alive},
+            }
+            if search_after is not None:
+                body["search_after"] = search_after
+
+            resp = await es.search(
+                body=body,
+                filter_path="pit_id,hits.hits._id,hits.hits.fields,hits.hits.sort",
+            )
+            pit_id = resp.get("pit_id", pit_id)
+            hits = resp.get("hits", {}).get("hits", [])
+            for hit in hits:
+                yield hit["_id"], hit.get("fields", {}).get("content_hash", [None])[0]
+
+            if len(hits) < page_size:
+                return
+            search_after = hits[-1]["sort"]
+    finally:
+        await es.close_point_in_time(body={"id": pit_id})
+
+
+async def diff(es, previous_index, new_hashes):
+    """
+    Compares the previous index with the csv hashes, returns the ids to
+    (re)index, new or changed, and the ids to delete. `new_hashes` is emptied.
+    """
+    remaining = new_hashes
+    changed = set()
+    deleted = []
+    async for doc_id, doc_hash in iterate_hashes(es, previous_index):
+        new_hash = remaining.pop(doc_id, None)
+        if new_hash is None:
+            deleted.append(doc_id)
+        elif new_hash != doc_hash:
+            changed.add(doc_id)
+
+    return changed | set(remaining), deleted, len(changed)
+
+
+async def reindex(es, source_index, dest_index, poll_interval=10):
+    """Server side copy of the whole source index, polled until it's done."""
+    task = await es.reindex(
+        body={"source": {"index": source_index, "size": 5000}, "dest": {"index": dest_index}},
+        wait_for_completion=False,
+        slices="auto",
+    )
+    while True:
+        await asyncio.sleep(poll_interval)
+        resp = await es.tasks.get(task_id=task["task"])
+        status = resp["task"]["status"]
+        print(f"Reindexed {status['created']}/{status['total']} documents")
+        if resp["completed"]:
+            if resp.get("error") or resp.get("response", {}).get("failures"):
+                raise RuntimeError(f"Reindex failed: {resp.get('error') or resp['response']['failures']}")
+            return status["created"]
+
+
+def delete_actions(index_name, doc_ids):
+    for doc_id in doc_ids:
+        yield {"_op_type": "delete", "_index": index_name, "_id": doc_id}
+
+
+async def warm_up(es, index_name, terms):
+    for term in terms:
+        await search_keywords_lean(es, term, index=index_name)
+
+
+async def delete_old_indices(es, keep, protected=(), alias=INDEX_ALIAS):
+    """Deletes the monthly indices older than the last `keep` ones, except `protected`."""
+    indices = sorted(await es.indices.get(index=f"{alias}_*"))
+    for index_name in indices[: max(len(indices) - keep, 0)]:
+        if index_name in protected:
+            continue
+        await es.indices.delete(index=index_name)
+        print(f"Deleted {index_name}")
+
+
+async def rollover(
+    es, file_paths, new_index=None, keep=2, warm_up_terms=None, locale=DEFAULT_LOCALE
+):
+    """
+    Builds next month's index of the locale from the csv files and swaps the
+    locale's alias to it, the other locales' indices aren't touched.
+
+    When the previous index has content hashes, it's copied server side with
+    `_reindex` and only the new or changed keywords are sent from the csv
+    files, the removed ones are deleted, so the client work scales with the
+    churn. Otherwise every keyword is indexed.
+    """
+    alias = locale.name
+    new_index = new_index or index_name_for(locale=locale)
+    previous_index = await get_alias_index(es, alias)
+    if previous_index == new_index:
+        raise ValueError(f"{alias} already points at {new_index}")
+
+    await create_index(es, new_index, locale)
+    t1 = time.perf_counter()
+
+    if previous_index is None or not await has_content_hash(es, previous_index):
+        print(f"Indexing every keyword into {new_index}")
+        await ingest(es, file_paths, new_index)
+    else:
+        new_hashes = await asyncio.to_thread(read_hashes, file_paths)
+        total = len(new_hashes)
+        to_index, to_delete, changed = await diff(es, previous_index, new_hashes)
+        print(
+            f"{len(to_index) - changed} new, {changed} changed, {len(to_delete)} removed "
+            f"keywords out of {total}"
+        )
+
+        async with load_settings(es, new_index):
+            copied = await reindex(es, previous_index, new_index)
+            print(f"Copied {copied} documents from {previous_index}")
+
+            actions = itertools.chain(
+                delete_actions(new_index, to_delete),
+                itertools.chain.from_iterable(
+                    generate_actions(file_path, new_index, to_index)
+                    for file_path in file_paths
+                ),
+            )
+            await bulk_load(es, actions)
+
+        await es.indices.refresh(index=new_index)
+        await es.indices.forcemerge(index=new_index, max_num_segments=1)
+
+    print(f"Built {new_index} in {time.perf_counter() - t1}")
+
+    # Wait for the restored replicas to be allocated, then warm them before serving
+    await es.cluster.health(
+        index=new_index,
+        wait_for_status="yellow",
+        wait_for_no_initializing_shards=True,
+        timeout="30m",
+    )
+    await warm_up(
+        es,
+        new_index,
+        warm_up_terms or [term for terms in TERMS.values() for term in terms],
+    )
+
+    await swap_alias(es, new_index, previous_index, alias)
+    print(f"Pointed {alias} at {new_index}, was {previous_index}")
+
+    await delete_old_indices(es, keep, protected={new_index, previous_index}, alias=alias)
+
+
+async def point_alias(es, index_name, alias=INDEX_ALIAS):
+    """
+    Points the alias at an existing index, e.g. one built before searches went
+    through the alias, without reindexing it.
+    """
+    if not await es.indices.exists(index=index_name):
+        raise ValueError(f"{index_name} doesn't exist")
+    previous_index = await get_alias_index(es, alias)
+    if previous_index != index_name:
+        await swap_alias(es, index_name, previous_index, alias)
+    print(f"Pointed {alias} at {index_name}, was {previous_index}")
+
+
+async def main(file_paths, new_index=None, keep=2, locale=DEFAULT_LOCALE, alias_only=False):
+    async with get_es_client() as es:
+        if alias_only:
+            await point_alias(es, new_index, locale.name)
+        else:
+            await rollover(es, file_paths, new_index, keep, locale=locale)
+
+
+def cli():
+    folder_path = os.path.join(Path(__file__).parent.parent, "postgres/papi")
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "file_paths",
+        nargs="*",
+        help="Keyword csv files of the month",
+        default=[os.path.join(folder_path, file) for file in sorted(os.listdir(folder_path))],
+    )
+    parser.add_argument(
+        "--index", type=str, help="New index name, defaults to the locale's monthly one", default=None
+    )
+    parser.add_argument("--keep", type=int, help="Monthly indices to keep", default=2)
+    parser.add_argument("--country", type=str, help="Locale country code", default=None)
+    parser.add_argument("--language", type=str, help="Locale language code", default=None)
+    parser.add_argument(
+        "--alias_only",
+        action="store_true",
+        help="Only point the locale's alias at the existing --index, nothing is indexed",
+    )
+    args = parser.parse_args()
+    locale = locale_for(args.country, args.language)
+    asyncio.run(
+        main(
+            args.file_paths,
+            args.index or index_name_for(date.today(), locale),
+            args.keep,
+            locale,
+            args.alias_only,
+        )
+    )
+
+
+if __name__ == "__main__":
+    """
+    python -m fts_elastic.rollover seed_data/*.csv --index adwords_en_us_2023_01
+    python -m fts_elastic.rollover --index adwords_en_us_2022_12 --alias_only
+    """
+    cli()
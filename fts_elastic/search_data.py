@@ -3,48 +3,194 @@ import time
 
 
 from fts_elastic.es_client import get_es_client
+from fts_elastic.index_creator import INDEX_ALIAS, PREFIX_MAX_GRAM
+from fts_elastic.msearch import MultiSearchBatcher
+from locales import DEFAULT_LOCALE
+from metrics import METRICS, span
 from utils import TERMS
 
 
-async def search_keywords(
-    es_client, term, columns, search_type="broad", total_keywords=1000
-):
+def build_search_body(term, columns, search_type="broad", total_keywords=1000):
     if search_type == "phrase":
         match = {"match_phrase": {"keyword": term}}
     else:
         match = {"match": {"keyword": {"query": term, "operator": "and"}}}
 
+    return {
+        "sort": [{"volume": "desc"}],
+        "query": {
+            "bool": {
+                "must": [match],
+                "must_not": [{"exists": {"field": "spell_type"}}],
+            }
+        },
+        "fields": columns,
+        "_source": False,
+        "size": total_keywords,
+    }
+
+
+def observe_took(resp):
+    """Server side time of a search, the rest of `es.search` is network and decoding."""
+    if "took" in resp:
+        METRICS.observe("es.server", resp["took"] / 1000)
+
+
+def parse_hits(resp):
+    results = []
+    for hit in resp.get("hits", {}).get("hits", []):
+        fields = hit["fields"]
+        results.append({"keyword": fields["keyword"][0], "volume": fields["volume"][0]})
+
+    return results
+
+
+async def search_keywords(
+    es_client,
+    term,
+    columns,
+    search_type="broad",
+    total_keywords=1000,
+    batcher=None,
+    locale=DEFAULT_LOCALE,
+):
+    """Searches only the `locale` alias, e.g. adwords_es_mx."""
+    body = build_search_body(term, columns, search_type, total_keywords)
+    with span("es.search"):
+        if batcher is not None:
+            resp = await batcher.search(body, index=locale.name)
+        else:
+            resp = await es_client.search(index=locale.name, body=body)
+    observe_took(resp)
+
+    with span("es.parse"):
+        return parse_hits(resp)
+
+
+async def search_keywords_lean(
+    es_client, term, search_type="broad", total_keywords=1000, index=INDEX_ALIAS
+):
+    """
+    Same search as `search_keywords`, returned as parallel (keywords, volumes)
+    lists. Keywords come from the `keyword.raw` doc values and volumes from
+    the sort values, and filter_path drops everything else from the response.
+    """
+    body = build_search_body(term, [], search_type, total_keywords)
+    del body["fields"]
+    body["docvalue_fields"] = ["keyword.raw"]
+    body["stored_fields"] = "_none_"
+    body["track_total_hits"] = False
+
+    with span("es.search"):
+        resp = await es_client.search(
+            index=index,
+            body=body,
+            filter_path="took,hits.hits.fields,hits.hits.sort",
+        )
+    observe_took(resp)
+
+    with span("es.parse"):
+        hits = resp.get("hits", {}).get("hits", [])
+        return [hit["fields"]["keyword.raw"][0] for hit in hits], [hit["sort"][0] for hit in hits]
+
+
+async def suggest_keywords(es_client, prefix, total_keywords=10, locale=DEFAULT_LOCALE):
+    """
+    Top keywords by volume starting with `prefix`, from the edge_ngram
+    `keyword.prefix` subfield. The index is sorted by volume, so without
+    total hits every shard stops after its first `total_keywords` matches.
+
+    Prefixes longer than PREFIX_MAX_GRAM aren't indexed there, they fall back
+    to a prefix query on `keyword.raw`, rare enough to match few keywords.
+    """
+    if len(prefix) > PREFIX_MAX_GRAM:
+        match = {"prefix": {"keyword.raw": {"value": prefix, "case_insensitive": True}}}
+    else:
+        match = {"match": {"keyword.prefix": prefix}}
+
     resp = await es_client.search(
-        index="adwords_en_us_2022_12",
+        index=locale.name,
         body={
             "sort": [{"volume": "desc"}],
             "query": {
                 "bool": {
-                    "must": [match],
+                    "filter": [match],
                     "must_not": [{"exists": {"field": "spell_type"}}],
                 }
             },
-            "fields": columns,
-            "source": False,
+            "fields": ["keyword", "volume"],
+            "_source": False,
+            "size": total_keywords,
+            "track_total_hits": False,
         },
-        size=total_keywords,
     )
 
-    results = []
-    for hit in resp.get("hits", {}).get("hits", []):
-        fields = hit["fields"]
-        results.append({"keyword": fields["keyword"][0], "volume": fields["volume"][0]})
+    return parse_hits(resp)
 
-    return results
 
+async def stream_keywords(
+    es_client,
+    term,
+    columns,
+    search_type="broad",
+    page_size=1000,
+    keep_alive="1m",
+    prefetch=True,
+    locale=DEFAULT_LOCALE,
+):
+    """
+    Yields every match in volume desc order, page by page with search_after
+    over a point in time, so the result set isn't capped by max_result_window.
+    With `prefetch` the next page is requested while the caller consumes the
+    current one.
+    """
+    pit = await es_client.open_point_in_time(
+        index=locale.name, keep_alive=keep_alive
+    )
+    pit_id = pit["id"]
+
+    async def fetch_page(search_after):
+        body = build_search_body(term, columns, search_type, page_size)
+        body["pit"] = {"id": pit_id, "keep_alive": keep_alive}
+        body["track_total_hits"] = False
+        if search_after is not None:
+            body["search_after"] = search_after
+        return await es_client.search(body=body)
+
+    next_page = asyncio.create_task(fetch_page(None))
+    try:
+        while next_page is not None:
+            resp = await next_page
+            next_page = None
+            pit_id = resp.get("pit_id", pit_id)
+
+            hits = resp["hits"]["hits"]
+            has_more = len(hits) == page_size
+            if has_more and prefetch:
+                next_page = asyncio.create_task(fetch_page(hits[-1]["sort"]))
 
-async def run(es_client, terms, search_types, add_suffix, project):
+            for result in parse_hits(resp):
+                yield result
+
+            if has_more and not prefetch:
+                next_page = asyncio.create_task(fetch_page(hits[-1]["sort"]))
+    finally:
+        if next_page is not None:
+            next_page.cancel()
+        await es_client.close_point_in_time(body={"id": pit_id})
+
+
+async def run(es_client, terms, search_types, add_suffix, project, batcher=None):
     for term in terms:
         for search_type in search_types:
             print(f"<<<<<<<<< Search type: {search_type}, term: {term} >>>>>>>>>")
             t1 = time.perf_counter()
             result = await search_keywords(
-                es_client, term, ["keyword", "volume"], search_type=search_type
+                es_client,
+                term,
+                ["keyword", "volume"],
+                search_type=search_type,
+                batcher=batcher,
             )
             print(result)
             print(f"Time taken, {term}: {time.perf_counter() - t1}")
@@ -58,11 +204,12 @@ async def main(project='papi'):
     add_suffix = project == 'dapi'
 
     async with get_es_client() as es_client:
-        await asyncio.gather(
-            run(es_client, TERMS["singe_word_terms"], search_types, add_suffix, project),
-            run(es_client, TERMS["two_word_terms"], search_types, add_suffix, project),
-            run(es_client, TERMS["three_word_terms"], search_types, add_suffix, project),
-        )
+        async with MultiSearchBatcher(es_client, INDEX_ALIAS) as batcher:
+            await asyncio.gather(
+                run(es_client, TERMS["singe_word_terms"], search_types, add_suffix, project, batcher),
+                run(es_client, TERMS["two_word_terms"], search_types, add_suffix, project, batcher),
+                run(es_client, TERMS["three_word_terms"], search_types, add_suffix, project, batcher),
+            )
 
 
 if __name__ == "__main__":
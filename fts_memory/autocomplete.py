@@ -0,0 +1,76 @@
+from bisect import bisect_left
+
+import numpy as np
+
+
+def prefix_upper_bound(prefix):
+    """Smallest string greater than every string starting with `prefix`."""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class Autocomplete:
+    """
+    Keywords sorted alphabetically, so the keywords starting with a prefix are
+    one contiguous range. Prefixes matching more than `scan_limit` keywords
+    (the heavy nodes of the implied trie) get their top `top_k` precomputed,
+    smaller ranges are ranked on the fly with argpartition.
+    """
+
+    def __init__(self, rows, top_k=10, scan_limit=2048):
+        self.top_k = top_k
+        self.scan_limit = scan_limit
+
+        items = sorted((keyword.lower(), keyword, volume) for keyword, volume in rows)
+        self.keys = [key for key, _, _ in items]
+        self.keywords = [keyword for _, keyword, _ in items]
+        self.volumes = np.fromiter(
+            (volume for _, _, volume in items), dtype=np.int64, count=len(items)
+        )
+
+        self.top = {}
+        self._precompute()
+
+    @classmethod
+    def from_index(cls, index, **kwargs):
+        return cls(zip(index.keywords, index.volumes.tolist()), **kwargs)
+
+    def _rank(self, lo, hi, k):
+        """Indices of the top k volumes in [lo, hi), volume desc then keyword."""
+        volumes = self.volumes[lo:hi]
+        if len(volumes) > k:
+            candidates = np.argpartition(-volumes, k - 1)[:k]
+        else:
+            candidates = np.arange(len(volumes))
+        order = np.lexsort((candidates, -volumes[candidates]))
+        return candidates[order] + lo
+
+    def _precompute(self):
+        stack = [("", 0, len(self.keys))]
+        while stack:
+            prefix, lo, hi = stack.pop()
+            if hi - lo <= self.scan_limit:
+                continue
+            self.top[prefix] = self._rank(lo, hi, self.top_k)
+
+            # Keys equal to the prefix sort first, then one range per next char
+            i = lo
+            while i < hi and len(self.keys[i]) == len(prefix):
+                i += 1
+            while i < hi:
+                child = prefix + self.keys[i][len(prefix)]
+                child_hi = bisect_left(self.keys, prefix_upper_bound(child), i, hi)
+                stack.append((child, i, child_hi))
+                i = child_hi
+
+    def suggest(self, prefix, total_keywords=10):
+        """Top keywords by volume starting with `prefix`, as (keyword, volume) pairs."""
+        prefix = prefix.lower()
+        top = self.top.get(prefix)
+        if top is not None and total_keywords <= self.top_k:
+            indices = top[:total_keywords]
+        else:
+            lo = bisect_left(self.keys, prefix) if prefix else 0
+            hi = bisect_left(self.keys, prefix_upper_bound(prefix), lo) if prefix else len(self.keys)
+            indices = self._rank(lo, hi, total_keywords)
+
+        return [(self.keywords[i], int(self.volumes[i])) for i in indices]
@@ -0,0 +1,226 @@
+import argparse
+import csv
+import json
+import mmap
+import os
+import struct
+import time
+from pathlib import Path
+
+import numpy as np
+
+from fts_memory.inverted_index import CORPUS_FOLDER, InvertedIndex, index_arrays
+
+CORPUS_PATH = os.path.join(Path(__file__).parent, "adwords_en_us.corpus")
+
+MAGIC = b"KWCORP1\0"
+ALIGNMENT = 64
+
+NUMERIC_COLUMNS = {"volume": np.int64, "cpc": np.float64, "competition": np.float64}
+TEXT_COLUMNS = ("keyword", "spell_type")
+
+
+def read_rows(file_paths):
+    for file_path in file_paths:
+        with open(file_path, mode="r") as f:
+            yield from csv.DictReader(f)
+
+
+def encode_text(values):
+    """Offsets (int64, one more than values) and utf-8 blob of a text column."""
+    encoded = [value.encode("utf-8") for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    return offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+
+def build_corpus(file_paths, output_path=CORPUS_PATH):
+    """
+    Writes the csv rows, deduplicated on keyword and sorted by volume desc, as
+    fixed width numeric arrays plus one utf-8 blob and offsets array per text
+    column. Every array starts on a 64 byte boundary so it can be mapped as is.
+
+    The inverted index of the rows without spell_type is stored too (see
+    `inverted_index.index_arrays`), its doc ids mapped to rows by `search_rows`,
+    so loading it maps the postings instead of tokenizing every keyword.
+
+    Layout: magic, header length (uint64), json header, arrays...
+    """
+    rows = {}
+    for row in read_rows(file_paths):
+        volume = int(float(row["volume"] or 0))
+        if row["keyword"] not in rows or volume > rows[row["keyword"]]["volume"]:
+            rows[row["keyword"]] = {
+                "keyword": row["keyword"],
+                "volume": volume,
+                "cpc": float(row.get("cpc") or 0),
+                "competition": float(row.get("competition") or 0),
+                "spell_type": row.get("spell_type") or "",
+            }
+    ranked = sorted(rows.values(), key=lambda r: (-r["volume"], r["keyword"]))
+
+    arrays = {}
+    for col, dtype in NUMERIC_COLUMNS.items():
+        arrays[col] = np.fromiter((r[col] for r in ranked), dtype=dtype, count=len(ranked))
+    for col in TEXT_COLUMNS:
+        arrays[f"{col}_offsets"], arrays[f"{col}_blob"] = encode_text(r[col] for r in ranked)
+
+    search_rows = [i for i, r in enumerate(ranked) if not r["spell_type"]]
+    arrays["search_rows"] = np.array(search_rows, dtype=np.int32)
+    index = index_arrays([ranked[i]["keyword"] for i in search_rows])
+    arrays["token_offsets"], arrays["token_blob"] = encode_text(index.pop("tokens"))
+    arrays.update(index)
+
+    # Offsets are relative to the end of the header, so the header can hold them
+    layout = {}
+    position = 0
+    for name, array in arrays.items():
+        layout[name] = {"dtype": array.dtype.str, "offset": position, "count": len(array)}
+        position += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+
+    header = json.dumps({"rows": len(ranked), "arrays": layout}).encode("utf-8")
+    data_start = -(-(len(MAGIC) + 8 + len(header)) // ALIGNMENT) * ALIGNMENT
+
+    with open(output_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(data_start + layout[name]["offset"])
+            f.write(array.tobytes())
+        f.truncate(data_start + position)
+
+    return len(ranked)
+
+
+class TextColumn:
+    """Lazily decoded text column, of the `rows` subset when given."""
+
+    def __init__(self, corpus, col, rows=None):
+        self.corpus = corpus
+        self.col = col
+        self.rows = rows
+
+    def __len__(self):
+        if self.rows is not None:
+            return len(self.rows)
+        return len(self.corpus.arrays[f"{self.col}_offsets"]) - 1
+
+    def __getitem__(self, i):
+        return self.corpus.text(self.col, i if self.rows is None else int(self.rows[i]))
+
+    def __iter__(self):
+        return iter(self.decode_all())
+
+    def decode_all(self):
+        """Decodes every value, one pass over the blob."""
+        offsets = self.corpus.arrays[f"{self.col}_offsets"].tolist()
+        blob = self.corpus.arrays[f"{self.col}_blob"].tobytes()
+        text = blob.decode("utf-8")
+        if text.isascii():
+            values = [text[start:end] for start, end in zip(offsets, offsets[1:])]
+        else:
+            values = [blob[start:end].decode("utf-8") for start, end in zip(offsets, offsets[1:])]
+
+        if self.rows is None:
+            return values
+        return [values[i] for i in self.rows.tolist()]
+
+
+class Corpus:
+    """Read only, memory mapped corpus, arrays are views on the mapped file."""
+
+    def __init__(self, path=CORPUS_PATH):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._mmap[: len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a keyword corpus")
+        header_length = struct.unpack_from("<Q", self._mmap, len(MAGIC))[0]
+        header_start = len(MAGIC) + 8
+        header = json.loads(self._mmap[header_start : header_start + header_length])
+        data_start = -(-(header_start + header_length) // ALIGNMENT) * ALIGNMENT
+
+        self.rows = header["rows"]
+        self.arrays = {
+            name: np.frombuffer(
+                self._mmap,
+                dtype=np.dtype(spec["dtype"]),
+                count=spec["count"],
+                offset=data_start + spec["offset"],
+            )
+            for name, spec in header["arrays"].items()
+        }
+
+    def __len__(self):
+        return self.rows
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__["arrays"][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def text(self, col, i):
+        offsets = self.arrays[f"{col}_offsets"]
+        return self.arrays[f"{col}_blob"][offsets[i] : offsets[i + 1]].tobytes().decode("utf-8")
+
+    def keyword(self, i):
+        return self.text("keyword", i)
+
+    def keywords(self):
+        """Decodes every keyword, one pass over the blob."""
+        return TextColumn(self, "keyword").decode_all()
+
+    @property
+    def has_postings(self):
+        """False for corpus files built before the postings were stored."""
+        return "posting_doc_ids" in self.arrays
+
+    def text_column(self, col):
+        """Lazy view of a text column, the keywords one in the inverted index's doc id order."""
+        rows = self.arrays["search_rows"] if col == "keyword" and self.has_postings else None
+        return TextColumn(self, col, rows)
+
+    @property
+    def search_volumes(self):
+        return self.arrays["volume"][self.arrays["search_rows"]]
+
+    def iter_search_rows(self):
+        """(keyword, volume) of the rows without spell_type, in volume desc order."""
+        has_spell_type = np.diff(self.arrays["spell_type_offsets"]) > 0
+        volumes = self.arrays["volume"].tolist()
+        for i, keyword in enumerate(self.keywords()):
+            if not has_spell_type[i]:
+                yield keyword, volumes[i]
+
+
+def load_index(path=CORPUS_PATH):
+    """Index from the corpus file when it was built, from the csv files otherwise."""
+    if os.path.exists(path):
+        return InvertedIndex.from_corpus(Corpus(path))
+    return InvertedIndex.from_folder()
+
+
+def cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "file_paths",
+        nargs="*",
+        help="Keyword csv files",
+        default=[
+            os.path.join(CORPUS_FOLDER, file)
+            for file in sorted(os.listdir(CORPUS_FOLDER))
+            if file.endswith(".csv")
+        ],
+    )
+    parser.add_argument("--output", type=str, help="Corpus file", default=CORPUS_PATH)
+    args = parser.parse_args()
+
+    t1 = time.perf_counter()
+    rows = build_corpus(args.file_paths, args.output)
+    print(f"Wrote {rows} keywords to {args.output} in {time.perf_counter() - t1}")
+
+
+if __name__ == "__main__":
+    cli()
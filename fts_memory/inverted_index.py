@@ -0,0 +1,247 @@
+import csv
+import itertools
+import os
+import re
+from pathlib import Path
+
+import numpy as np
+import snowballstemmer
+
+CORPUS_FOLDER = os.path.join(Path(__file__).parent.parent, "postgres/papi")
+
+# Words, hyphenated words being kept whole too, as postgres' default parser does
+TOKEN_PATTERN = re.compile(r"[^\W_]+(?:-[^\W_]+)*")
+
+# Same list postgres uses for the `english` text search config
+STOP_WORDS = frozenset(
+    """
+    i me my myself we our ours ourselves you your yours yourself yourselves he
+    him his himself she her hers herself it its itself they them their theirs
+    themselves what which who whom this that these those am is are was were be
+    been being have has had having do does did doing a an the and but if or
+    because as until while of at by for with about against between into
+    through during before after above below to from up down in out on off over
+    under again further then once here there when where why how all any both
+    each few more most other some such no nor not only own same so than too
+    very s t can will just don should now
+    """.split()
+)
+
+
+STEMMER = snowballstemmer.stemmer("english")
+
+
+def stem(word):
+    """
+    Snowball english stem, the `english_stem` dictionary of postgres. Words
+    with digits go to its `simple` dictionary instead: kept as is, even stop words.
+    """
+    if any(char.isdigit() for char in word):
+        return word
+    if word in STOP_WORDS:
+        return None
+    return STEMMER.stemWord(word)
+
+
+def tokenize(text):
+    """
+    Returns (position, token) pairs like postgres' to_tsvector: a hyphenated
+    word is indexed whole then part by part, each at its own position, and
+    stop words keep their position but no token.
+    """
+    tokens = []
+    for word in TOKEN_PATTERN.findall(text.lower()):
+        words = [word, *word.split("-")] if "-" in word else [word]
+        tokens.extend((len(tokens), stem(w)) for w in words)
+    return tokens
+
+
+def read_corpus(folder_path=CORPUS_FOLDER):
+    for file in sorted(os.listdir(folder_path)):
+        if not file.endswith(".csv"):
+            continue
+
+        with open(os.path.join(folder_path, file), mode="r") as f:
+            for row in csv.DictReader(f):
+                if row.get("spell_type"):
+                    continue
+                yield row["keyword"], int(row["volume"])
+
+
+def index_arrays(keywords, searchable=None):
+    """
+    Posting lists and token sequences of `keywords`, the doc id being the
+    position in `keywords`, as flat arrays the corpus file can store and map:
+
+    - `tokens`: the distinct tokens, a token id is its position
+    - `posting_doc_ids[posting_offsets[t]:posting_offsets[t + 1]]`: sorted doc ids of token t
+    - `doc_token_ids[doc_token_offsets[d]:doc_token_offsets[d + 1]]`: token ids of doc d
+      by position, -1 for stop words
+
+    Docs where `searchable` is false get no tokens.
+    """
+    token_ids = {}
+    postings = []
+    doc_token_ids = []
+    doc_token_offsets = [0]
+    for doc_id, keyword in enumerate(keywords):
+        if searchable is None or searchable[doc_id]:
+            ids = []
+            for _, token in tokenize(keyword):
+                if token is None:
+                    ids.append(-1)
+                    continue
+                token_id = token_ids.setdefault(token, len(postings))
+                if token_id == len(postings):
+                    postings.append([])
+                ids.append(token_id)
+            doc_token_ids.extend(ids)
+            for token_id in set(ids) - {-1}:
+                postings[token_id].append(doc_id)
+        doc_token_offsets.append(len(doc_token_ids))
+
+    posting_offsets = np.zeros(len(postings) + 1, dtype=np.int64)
+    np.cumsum([len(posting) for posting in postings], out=posting_offsets[1:])
+    return {
+        "tokens": list(token_ids),
+        "posting_offsets": posting_offsets,
+        "posting_doc_ids": np.fromiter(
+            itertools.chain.from_iterable(postings), dtype=np.int32, count=posting_offsets[-1]
+        ),
+        "doc_token_offsets": np.array(doc_token_offsets, dtype=np.int64),
+        "doc_token_ids": np.array(doc_token_ids, dtype=np.int32),
+    }
+
+
+class InvertedIndex:
+    """
+    Keyword corpus held in memory. Doc ids are assigned in volume desc order, so
+    every posting list (sorted by doc id) is also sorted by volume desc and the
+    first k matches of an intersection are the top k by volume.
+
+    `keywords` only needs indexing and iteration, the corpus file passes a
+    lazy view. The arrays are those of `index_arrays`.
+    """
+
+    def __init__(
+        self,
+        keywords,
+        volumes,
+        tokens,
+        posting_offsets,
+        posting_doc_ids,
+        doc_token_offsets,
+        doc_token_ids,
+    ):
+        self.keywords = keywords
+        self.volumes = volumes
+        self.token_ids = {token: token_id for token_id, token in enumerate(tokens)}
+        self.posting_offsets = posting_offsets
+        self.posting_doc_ids = posting_doc_ids
+        self.doc_token_offsets = doc_token_offsets
+        self.doc_token_ids = doc_token_ids
+
+    @classmethod
+    def from_rows(cls, rows):
+        """From (keyword, volume) rows, deduplicated on keyword keeping the highest volume."""
+        volumes = {}
+        for keyword, volume in rows:
+            if volume > volumes.get(keyword, -1):
+                volumes[keyword] = volume
+
+        ranked = sorted(volumes.items(), key=lambda kv: (-kv[1], kv[0]))
+        keywords = [keyword for keyword, _ in ranked]
+        return cls(
+            keywords,
+            np.fromiter((volume for _, volume in ranked), dtype=np.int64, count=len(ranked)),
+            **index_arrays(keywords),
+        )
+
+    @classmethod
+    def from_folder(cls, folder_path=CORPUS_FOLDER):
+        return cls.from_rows(read_corpus(folder_path))
+
+    @classmethod
+    def from_corpus(cls, corpus):
+        """
+        From a memory mapped `fts_memory.corpus.Corpus`. With its stored
+        postings nothing is decoded, tokenized or sorted but the token list.
+        """
+        if not corpus.has_postings:
+            return cls.from_rows(corpus.iter_search_rows())
+        return cls(
+            corpus.text_column("keyword"),
+            corpus.search_volumes,
+            corpus.text_column("token").decode_all(),
+            corpus.posting_offsets,
+            corpus.posting_doc_ids,
+            corpus.doc_token_offsets,
+            corpus.doc_token_ids,
+        )
+
+    def __len__(self):
+        return len(self.keywords)
+
+    def posting(self, token_id):
+        return self.posting_doc_ids[
+            self.posting_offsets[token_id] : self.posting_offsets[token_id + 1]
+        ]
+
+    def _intersect(self, token_ids, chunk_size):
+        """Yields chunks of matching doc ids in volume desc order."""
+        postings = sorted((self.posting(t) for t in set(token_ids)), key=len)
+
+        base, others = postings[0], postings[1:]
+        for start in range(0, len(base), chunk_size):
+            candidates = base[start : start + chunk_size]
+            for other in others:
+                idx = np.minimum(np.searchsorted(other, candidates), len(other) - 1)
+                candidates = candidates[other[idx] == candidates]
+                if not len(candidates):
+                    break
+            yield candidates
+
+    def _matches_phrase(self, doc_id, phrase):
+        doc_tokens = self.doc_token_ids[
+            self.doc_token_offsets[doc_id] : self.doc_token_offsets[doc_id + 1]
+        ].tolist()
+        first_offset, first_token = phrase[0]
+        for position, token in enumerate(doc_tokens):
+            if token != first_token:
+                continue
+            start = position - first_offset
+            if all(
+                0 <= start + offset < len(doc_tokens)
+                and doc_tokens[start + offset] == t
+                for offset, t in phrase[1:]
+            ):
+                return True
+        return False
+
+    def search(self, term, search_type="broad", total_keywords=1000):
+        """Returns doc ids of the top `total_keywords` matches by volume."""
+        phrase = [(p, token) for p, token in tokenize(term) if token is not None]
+        if not phrase:
+            return []
+        if any(token not in self.token_ids for _, token in phrase):
+            return []
+        phrase = [(p, self.token_ids[token]) for p, token in phrase]
+        tokens = [token for _, token in phrase]
+        is_match = {
+            "phrase": lambda doc_id: self._matches_phrase(doc_id, phrase),
+            "broad": None,
+        }[search_type]
+        if len(phrase) == 1:
+            is_match = None
+
+        doc_ids = []
+        for candidates in self._intersect(tokens, max(total_keywords, 256)):
+            if is_match is not None:
+                candidates = [d for d in candidates.tolist() if is_match(d)]
+            else:
+                candidates = candidates.tolist()
+            doc_ids.extend(candidates[: total_keywords - len(doc_ids)])
+            if len(doc_ids) >= total_keywords:
+                break
+
+        return doc_ids
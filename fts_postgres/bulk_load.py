@@ -0,0 +1,218 @@
+import argparse
+import asyncio
+import csv
+import os
+import time
+
+from fts_postgres.pg_client import get_pg_pool
+from fts_postgres.top_keywords import build_top_keywords
+from locales import DEFAULT_LOCALE, locale_for
+
+TABLE_NAME = DEFAULT_LOCALE.name
+
+COLUMN_TYPES = {
+    "keyword": str,
+    "volume": int,
+    "cpc": float,
+    "competition": float,
+    "spell_type": str,
+}
+
+
+def index_statements(table_name):
+    """Same definitions as initdb.d/01.create_db.sql, for any locale table."""
+    return {
+        f"{table_name}_keyword_tsv_idx": f"create index {table_name}_keyword_tsv_idx on {table_name} using gin(keyword_tsv)",
+        f"{table_name}_spell_type_volume_idx": f"create index {table_name}_spell_type_volume_idx on {table_name} (spell_type, volume desc)",
+    }
+
+
+INDEXES = index_statements(TABLE_NAME)
+
+
+def read_header(file_path):
+    with open(file_path, mode="r") as f:
+        return next(csv.reader(f))
+
+
+def split_file(file_path, parts):
+    """Splits a csv file into `parts` byte ranges, the header is left out."""
+    with open(file_path, mode="rb") as f:
+        data_start = len(f.readline())
+    size = os.path.getsize(file_path)
+
+    step = max((size - data_start) // parts, 1)
+    bounds = list(range(data_start, size, step))[:parts] + [size]
+    return [(file_path, start, end) for start, end in zip(bounds, bounds[1:])]
+
+
+def read_lines(file_path, start, end):
+    """
+    Lines starting inside [start, end). A range that starts mid line skips it,
+    the previous range reads it to the end.
+    """
+    with open(file_path, mode="rb") as f:
+        f.seek(start)
+        if start > 0:
+            f.seek(start - 1)
+            f.readline()
+
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            yield line.decode("utf-8")
+
+
+def to_record(row, header):
+    return tuple(
+        COLUMN_TYPES[col](value) if value != "" else None
+        for col, value in zip(header, row)
+    )
+
+
+def read_batch(rows, header, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(to_record(row, header))
+        if len(batch) >= batch_size:
+            break
+
+    return batch
+
+
+class Progress:
+    def __init__(self):
+        self.rows = 0
+        self.started_at = time.perf_counter()
+
+    @property
+    def rows_per_sec(self):
+        return self.rows / max(time.perf_counter() - self.started_at, 1e-9)
+
+    async def report(self, interval=5):
+        while True:
+            await asyncio.sleep(interval)
+            print(f"Loaded {self.rows} rows, {self.rows_per_sec:.0f} rows/sec")
+
+
+async def copy_range(pool, file_range, progress, batch_size, table_name=TABLE_NAME):
+    file_path, start, end = file_range
+    header = read_header(file_path)
+    columns = [col for col in header if col in COLUMN_TYPES]
+    if columns != header:
+        raise ValueError(f"Unknown columns in {file_path}: {header}")
+
+    rows = csv.reader(read_lines(file_path, start, end))
+    async with pool.acquire() as conn:
+        while True:
+            batch = await asyncio.to_thread(read_batch, rows, header, batch_size)
+            if not batch:
+                return
+
+            await conn.copy_records_to_table(table_name, records=batch, columns=columns)
+            progress.rows += len(batch)
+
+
+async def drop_indexes(pool, table_name=TABLE_NAME):
+    async with pool.acquire() as conn:
+        for index_name in index_statements(table_name):
+            await conn.execute(f"drop index if exists {index_name}")
+
+
+async def create_indexes(pool, table_name=TABLE_NAME):
+    async def _create(index_name, statement):
+        t1 = time.perf_counter()
+        async with pool.acquire() as conn:
+            await conn.execute(statement)
+        print(f"Created {index_name} in {time.perf_counter() - t1}")
+
+    await asyncio.gather(
+        *[_create(name, stmt) for name, stmt in index_statements(table_name).items()]
+    )
+
+
+async def load(
+    file_paths, workers=4, batch_size=50000, rebuild_indexes=False, locale=DEFAULT_LOCALE
+):
+    """
+    Copies csv files into the locale's table (adwords_en_us by default) over
+    `workers` connections, each file split in byte ranges so a single big
+    file is loaded in parallel too.
+
+    With `rebuild_indexes` the search indexes and the top keywords triggers are
+    dropped/disabled during the load and rebuilt once at the end, even when
+    the load fails.
+    """
+    table_name = locale.name
+    file_ranges = [
+        file_range
+        for file_path in file_paths
+        for file_range in split_file(file_path, workers)
+    ]
+    progress = Progress()
+
+    async with get_pg_pool(min_size=workers, max_size=workers) as pool:
+        if rebuild_indexes:
+            await drop_indexes(pool, table_name)
+            await pool.execute(f"alter table {table_name} disable trigger user")
+
+        semaphore = asyncio.Semaphore(workers)
+
+        async def _copy(file_range):
+            async with semaphore:
+                await copy_range(pool, file_range, progress, batch_size, table_name)
+
+        reporter = asyncio.create_task(progress.report())
+        copies = [asyncio.create_task(_copy(file_range)) for file_range in file_ranges]
+        try:
+            await asyncio.gather(*copies)
+            print(f"Loaded {progress.rows} rows, {progress.rows_per_sec:.0f} rows/sec")
+        finally:
+            reporter.cancel()
+            for copy in copies:
+                copy.cancel()
+            await asyncio.gather(*copies, return_exceptions=True)
+
+            # Also after a failed COPY, the batches before it are committed
+            if rebuild_indexes:
+                await create_indexes(pool, table_name)
+                await pool.execute(f"alter table {table_name} enable trigger user")
+                # Top keywords are only kept for the default locale
+                if locale == DEFAULT_LOCALE:
+                    async with pool.acquire() as conn:
+                        tokens = await build_top_keywords(conn)
+                    print(f"Built top keywords for {tokens} tokens")
+
+    return progress.rows
+
+
+def cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("file_paths", nargs="+", help="Keyword csv files")
+    parser.add_argument("--workers", type=int, help="Parallel COPY connections", default=4)
+    parser.add_argument("--batch_size", type=int, help="Rows per COPY", default=50000)
+    parser.add_argument(
+        "--rebuild_indexes",
+        action="store_true",
+        help="Drop the search indexes during the load and rebuild them after",
+    )
+    parser.add_argument("--country", type=str, help="Locale country code", default=None)
+    parser.add_argument("--language", type=str, help="Locale language code", default=None)
+    args = parser.parse_args()
+    asyncio.run(
+        load(
+            args.file_paths,
+            args.workers,
+            args.batch_size,
+            args.rebuild_indexes,
+            locale_for(args.country, args.language),
+        )
+    )
+
+
+if __name__ == "__main__":
+    """
+    python -m fts_postgres.bulk_load seed_data/*.csv --workers 8 --rebuild_indexes
+    """
+    cli()
@@ -0,0 +1,54 @@
+import argparse
+import asyncio
+
+from fts_postgres.bulk_load import index_statements
+from fts_postgres.pg_client import db_connection, db_params
+from locales import locale_for
+
+# Same table as initdb.d/01.create_db.sql, with the locale's text search config
+CREATE_TABLE_QUERY = """
+    create table if not exists {table_name} (
+        keyword text primary key,
+        keyword_tsv tsvector generated always as ( to_tsvector('{config}', keyword)) stored,
+        volume int not null,
+        cpc float default  0.0,
+        competition float default  0.0,
+        spell_type varchar(32)
+    );
+"""
+
+
+async def create_locale_table(conn, locale):
+    """
+    One table per locale, each with its own tsvector config and indexes, so a
+    query only touches its locale's GIN index. Declarative partitions can't
+    have a different generated column expression per partition.
+    """
+    async with conn.transaction():
+        await conn.execute(
+            CREATE_TABLE_QUERY.format(table_name=locale.name, config=locale.text_search_config)
+        )
+        for statement in index_statements(locale.name).values():
+            await conn.execute(statement.replace("create index", "create index if not exists", 1))
+
+
+async def main(country, language):
+    locale = locale_for(country, language)
+    async with db_connection(**db_params) as conn:
+        await create_locale_table(conn, locale)
+    print(f"Created {locale.name} with the {locale.text_search_config} text search config")
+
+
+def cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("country", type=str, help="ISO 3166 country code, e.g. mx")
+    parser.add_argument("language", type=str, help="ISO 639-1 language code, e.g. es")
+    args = parser.parse_args()
+    asyncio.run(main(args.country, args.language))
+
+
+if __name__ == "__main__":
+    """
+    python -m fts_postgres.locale_tables mx es
+    """
+    cli()
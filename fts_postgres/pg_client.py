@@ -0,0 +1,75 @@
+import os
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+import asyncpg
+from dotenv import load_dotenv
+
+from metrics import METRICS, register_pool_gauges, span
+
+dotenv_path = os.path.join(Path(__file__).parent.parent, ".env")
+load_dotenv(dotenv_path)
+
+
+db_params = {
+    "user": os.getenv("DB_USER"),
+    "password": os.getenv("DB_PASSWORD"),
+    "database": os.getenv("DB_NAME"),
+    "host": os.getenv("DB_HOST"),
+    "port": os.getenv("DB_PORT"),
+}
+
+
+class SearchConnection(asyncpg.Connection):
+    """Keeps the search statements prepared for the lifetime of the connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._prepared_statements = {}
+
+    async def fetch_prepared(self, query, *args):
+        statement = self._prepared_statements.get(query)
+        if statement is None:
+            statement = await self.prepare(query)
+            self._prepared_statements[query] = statement
+        return await statement.fetch(*args)
+
+
+@asynccontextmanager
+async def db_connection(**kwargs):
+    conn = await asyncpg.connect(
+        user=kwargs.get("user"),
+        password=kwargs.get("password"),
+        database=kwargs.get("database"),
+        host=kwargs.get("host"),
+        port=kwargs.get("port"),
+    )
+    yield conn
+    await conn.close()
+
+
+@asynccontextmanager
+async def get_pg_pool(min_size=10, max_size=10, name="pg", **kwargs):
+    pool = await asyncpg.create_pool(
+        min_size=min_size,
+        max_size=max_size,
+        connection_class=SearchConnection,
+        **{**db_params, **kwargs},
+    )
+    register_pool_gauges(pool, name)
+
+    yield pool
+
+    METRICS.unregister_gauges(pool=name)
+    await pool.close()
+
+
+@asynccontextmanager
+async def acquire(pool):
+    """`pool.acquire()`, with the wait for a free connection timed as `pg.acquire`."""
+    with span("pg.acquire"):
+        conn = await pool.acquire()
+    try:
+        yield conn
+    finally:
+        await pool.release(conn)
@@ -0,0 +1,139 @@
+from functools import lru_cache
+
+from locales import DEFAULT_LOCALE
+
+COLUMNS = ("keyword", "volume", "cpc", "competition", "spell_type")
+
+TSQUERY_FUNCTIONS = {"phrase": "phraseto_tsquery", "broad": "plainto_tsquery"}
+
+
+def tsquery_function(search_type):
+    return TSQUERY_FUNCTIONS[search_type]
+
+
+def validate_columns(columns):
+    unknown_columns = set(columns) - set(COLUMNS)
+    if unknown_columns:
+        raise ValueError(f"Unknown columns: {', '.join(sorted(unknown_columns))}")
+
+
+@lru_cache(maxsize=None)
+def build_search_query(columns, search_type, locale=DEFAULT_LOCALE):
+    """Same text for every term of a locale, so each connection parses and plans it once."""
+    validate_columns(columns)
+
+    return f"""
+        select {', '.join(columns)}
+        from {locale.name}
+        where keyword_tsv @@ {tsquery_function(search_type)}('{locale.text_search_config}', $1)
+        and spell_type is null
+        order by volume desc
+        limit $2;
+    """
+
+
+async def search_keywords(
+    conn, term, columns, search_type="broad", total_keywords=1000, locale=DEFAULT_LOCALE
+):
+    query = build_search_query(tuple(columns), search_type, locale)
+    return await conn.fetch_prepared(query, term, total_keywords)
+
+
+@lru_cache(maxsize=None)
+def build_batch_search_query(columns, search_type, locale=DEFAULT_LOCALE):
+    """Top keywords for every term of $1 in a single statement."""
+    validate_columns(columns)
+
+    return f"""
+        select terms.term, {', '.join(f'matched.{col}' for col in columns)}
+        from unnest($1::text[]) with ordinality as terms(term, term_index)
+        cross join lateral (
+            select {', '.join(columns)}, volume as rank_volume
+            from {locale.name}
+            where keyword_tsv @@ {tsquery_function(search_type)}('{locale.text_search_config}', terms.term)
+            and spell_type is null
+            order by volume desc
+            limit $2
+        ) matched
+        order by terms.term_index, matched.rank_volume desc;
+    """
+
+
+async def search_keywords_batch(
+    conn, terms, columns, search_type="broad", total_keywords=1000, locale=DEFAULT_LOCALE
+):
+    results = {term: [] for term in terms}
+    query = build_batch_search_query(tuple(columns), search_type, locale)
+    for r in await conn.fetch_prepared(query, list(results), total_keywords):
+        results[r["term"]].append(r)
+
+    return results
+
+
+@lru_cache(maxsize=None)
+def build_stream_query(columns, search_type, locale=DEFAULT_LOCALE):
+    validate_columns(columns)
+
+    return f"""
+        select {', '.join(columns)}
+        from {locale.name}
+        where keyword_tsv @@ {tsquery_function(search_type)}('{locale.text_search_config}', $1)
+        and spell_type is null
+        order by volume desc;
+    """
+
+
+async def stream_keywords(
+    conn, term, columns, search_type="broad", batch_size=1000, locale=DEFAULT_LOCALE
+):
+    """
+    Yields every match in volume desc order, `batch_size` rows at a time from a
+    server side cursor, so the match set is never held in memory at once.
+    """
+    query = build_stream_query(tuple(columns), search_type, locale)
+    async with conn.transaction():
+        cursor = await conn.cursor(query, term)
+        while True:
+            rows = await cursor.fetch(batch_size)
+            if not rows:
+                return
+            yield rows
+
+
+@lru_cache(maxsize=None)
+def build_page_query(columns, search_type, has_after, locale=DEFAULT_LOCALE):
+    """Keyset page ordered by (volume, keyword) desc, $2/$3 are the last row of the previous page."""
+    validate_columns(columns)
+    select_columns = list(columns) + [col for col in ("volume", "keyword") if col not in columns]
+    after = "and (volume, keyword) < ($2, $3)" if has_after else ""
+    limit = "$4" if has_after else "$2"
+
+    return f"""
+        select {', '.join(select_columns)}
+        from {locale.name}
+        where keyword_tsv @@ {tsquery_function(search_type)}('{locale.text_search_config}', $1)
+        and spell_type is null
+        {after}
+        order by volume desc, keyword desc
+        limit {limit};
+    """
+
+
+async def fetch_keywords_page(
+    conn,
+    term,
+    columns,
+    search_type="broad",
+    page_size=1000,
+    after=None,
+    locale=DEFAULT_LOCALE,
+):
+    """Returns a page of matches and the `after` cursor of the next one, None on the last page."""
+    query = build_page_query(tuple(columns), search_type, after is not None, locale)
+    if after is None:
+        rows = await conn.fetch_prepared(query, term, page_size)
+    else:
+        rows = await conn.fetch_prepared(query, term, *after, page_size)
+
+    next_after = (rows[-1]["volume"], rows[-1]["keyword"]) if len(rows) == page_size else None
+    return rows, next_after
@@ -0,0 +1,187 @@
+import argparse
+import asyncio
+import json
+import time
+
+from fts_postgres.bulk_load import TABLE_NAME, Progress, copy_range, split_file
+from fts_postgres.pg_client import get_pg_pool
+from fts_postgres.top_keywords import refresh_top_keywords
+
+STAGING_TABLE = "adwords_en_us_staging"
+
+# Rows of the diff, numbered so they can be applied in id ranges
+DIFF_QUERIES = {
+    "inserts": f"""
+        create temp table refresh_inserts as
+        select row_number() over () as id, s.keyword
+        from {STAGING_TABLE} s
+        left join {TABLE_NAME} l using (keyword)
+        where l.keyword is null;
+    """,
+    "updates": f"""
+        create temp table refresh_updates as
+        select row_number() over () as id, s.keyword
+        from {STAGING_TABLE} s
+        join {TABLE_NAME} l using (keyword)
+        where (s.volume, s.cpc, s.competition, s.spell_type)
+            is distinct from (l.volume, l.cpc, l.competition, l.spell_type);
+    """,
+    "deletes": f"""
+        create temp table refresh_deletes as
+        select row_number() over () as id, l.keyword
+        from {TABLE_NAME} l
+        left join {STAGING_TABLE} s using (keyword)
+        where s.keyword is null;
+    """,
+}
+
+APPLY_QUERIES = {
+    "inserts": f"""
+        insert into {TABLE_NAME} (keyword, volume, cpc, competition, spell_type)
+        select s.keyword, s.volume, s.cpc, s.competition, s.spell_type
+        from refresh_inserts i
+        join {STAGING_TABLE} s using (keyword)
+        where i.id > $1 and i.id <= $2;
+    """,
+    "updates": f"""
+        update {TABLE_NAME} l
+        set volume = s.volume, cpc = s.cpc, competition = s.competition, spell_type = s.spell_type
+        from refresh_updates u
+        join {STAGING_TABLE} s using (keyword)
+        where l.keyword = u.keyword and u.id > $1 and u.id <= $2;
+    """,
+    "deletes": f"""
+        delete from {TABLE_NAME} l
+        using refresh_deletes d
+        where l.keyword = d.keyword and d.id > $1 and d.id <= $2;
+    """,
+}
+
+
+async def load_staging(pool, file_paths, workers, batch_size):
+    async with pool.acquire() as conn:
+        await conn.execute(f"truncate {STAGING_TABLE}")
+
+    file_ranges = [
+        file_range
+        for file_path in file_paths
+        for file_range in split_file(file_path, workers)
+    ]
+    progress = Progress()
+    semaphore = asyncio.Semaphore(workers)
+
+    async def _copy(file_range):
+        async with semaphore:
+            await copy_range(pool, file_range, progress, batch_size, STAGING_TABLE)
+
+    reporter = asyncio.create_task(progress.report())
+    try:
+        await asyncio.gather(*[_copy(file_range) for file_range in file_ranges])
+    finally:
+        reporter.cancel()
+
+    async with pool.acquire() as conn:
+        await conn.execute(f"analyze {STAGING_TABLE}")
+
+    return progress.rows
+
+
+async def apply_changes(conn, change, total, batch_size):
+    """Applies one kind of change, `batch_size` rows per transaction."""
+    for start in range(0, total, batch_size):
+        async with conn.transaction():
+            await conn.execute(APPLY_QUERIES[change], start, start + batch_size)
+
+
+async def refresh(
+    file_paths, workers=4, copy_batch_size=50000, batch_size=5000, max_delete_ratio=0.2
+):
+    """
+    Copies the csv snapshot into the unlogged staging table, diffs it with
+    adwords_en_us on keyword and applies only the inserts, updates and
+    deletes, `batch_size` rows per transaction, so unchanged rows keep their
+    tsvector and index entries and searches aren't blocked by one big
+    transaction. The top keywords of the changed tokens are refreshed last.
+
+    Refuses to delete more than `max_delete_ratio` of the live rows, a
+    truncated snapshot would otherwise empty the table.
+    """
+    report = {}
+    t1 = time.perf_counter()
+
+    async with get_pg_pool(min_size=1, max_size=workers) as pool:
+        report["staged"] = await load_staging(pool, file_paths, workers, copy_batch_size)
+        report["copy_seconds"] = time.perf_counter() - t1
+
+        async with pool.acquire() as conn:
+            t2 = time.perf_counter()
+            report["live"] = await conn.fetchval(f"select count(*) from {TABLE_NAME}")
+            for change, query in DIFF_QUERIES.items():
+                await conn.execute(query)
+                await conn.execute(f"create index on refresh_{change} (id)")
+                report[change] = await conn.fetchval(f"select count(*) from refresh_{change}")
+            report["diff_seconds"] = time.perf_counter() - t2
+
+            report["unchanged"] = report["staged"] - report["inserts"] - report["updates"]
+            report["churn"] = (
+                report["inserts"] + report["updates"] + report["deletes"]
+            ) / max(report["live"], 1)
+            print(f"Churn: {json.dumps(report)}")
+
+            if report["deletes"] > max_delete_ratio * report["live"]:
+                raise ValueError(
+                    f"Refusing to delete {report['deletes']} of {report['live']} rows, "
+                    f"more than max_delete_ratio={max_delete_ratio}"
+                )
+
+            t3 = time.perf_counter()
+            try:
+                for change in ("deletes", "updates", "inserts"):
+                    await apply_changes(conn, change, report[change], batch_size)
+                    print(f"Applied {report[change]} {change}")
+            finally:
+                for change in DIFF_QUERIES:
+                    await conn.execute(f"drop table if exists refresh_{change}")
+            report["apply_seconds"] = time.perf_counter() - t3
+
+            await conn.execute(f"truncate {STAGING_TABLE}")
+            await conn.execute(f"analyze {TABLE_NAME}")
+
+            t4 = time.perf_counter()
+            report["stale_tokens"] = await refresh_top_keywords(conn)
+            report["top_keywords_seconds"] = time.perf_counter() - t4
+
+    report["total_seconds"] = time.perf_counter() - t1
+    print(f"Refresh done: {json.dumps(report)}")
+    return report
+
+
+def cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("file_paths", nargs="+", help="Keyword csv files of the new snapshot")
+    parser.add_argument("--workers", type=int, help="Parallel COPY connections", default=4)
+    parser.add_argument("--copy_batch_size", type=int, help="Rows per COPY", default=50000)
+    parser.add_argument("--batch_size", type=int, help="Rows changed per transaction", default=5000)
+    parser.add_argument(
+        "--max_delete_ratio",
+        type=float,
+        help="Abort when the snapshot would delete more than this share of the rows",
+        default=0.2,
+    )
+    args = parser.parse_args()
+    asyncio.run(
+        refresh(
+            args.file_paths,
+            args.workers,
+            args.copy_batch_size,
+            args.batch_size,
+            args.max_delete_ratio,
+        )
+    )
+
+
+if __name__ == "__main__":
+    """
+    python -m fts_postgres.refresh seed_data/*.csv --batch_size 5000
+    """
+    cli()
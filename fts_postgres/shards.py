@@ -0,0 +1,363 @@
+import argparse
+import asyncio
+import csv
+import hashlib
+import heapq
+import os
+import time
+from contextlib import asynccontextmanager
+from itertools import islice
+
+import asyncpg
+
+from fts_postgres.bulk_load import (
+    COLUMN_TYPES,
+    TABLE_NAME,
+    Progress,
+    read_batch,
+    read_header,
+    read_lines,
+    split_file,
+)
+from fts_postgres.pg_client import SearchConnection, acquire, db_params
+from fts_postgres.top_keywords import build_top_keywords
+from metrics import METRICS, register_pool_gauges
+
+
+def shard_params(shards=None):
+    """
+    (id, connection params) of every shard, from DB_SHARDS: a comma separated
+    id=host:port list sharing the user, password and database of the .env.
+
+    The id, not the address, decides which keywords a shard owns, so the same
+    shards reached under other addresses keep their keywords. An entry without
+    an id uses its host:port as id. Without DB_SHARDS the single DB_HOST
+    database is the only shard.
+    """
+    shards = shards if shards is not None else os.getenv("DB_SHARDS")
+    if not shards:
+        return [(shard_name(db_params), dict(db_params))]
+
+    params = []
+    for shard in shards.split(","):
+        shard_id, _, address = shard.strip().rpartition("=")
+        host, _, port = address.rpartition(":")
+        params.append((shard_id or address, {**db_params, "host": host, "port": port}))
+
+    shard_ids = [shard_id for shard_id, _ in params]
+    if len(set(shard_ids)) != len(shard_ids):
+        raise ValueError(f"Duplicate shard ids in DB_SHARDS: {shard_ids}")
+
+    return params
+
+
+def shard_name(params):
+    return f"{params['host']}:{params['port']}"
+
+
+def shard_weight(name, keyword):
+    digest = hashlib.blake2b(f"{name}/{keyword}".encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def shard_for(keyword, names):
+    """
+    Index of the shard owning `keyword`, by rendezvous hashing: adding a shard
+    only moves the keywords the new shard wins, about 1/N of them.
+    """
+    return max(range(len(names)), key=lambda i: shard_weight(names[i], keyword))
+
+
+def partition(records, names):
+    """Splits (keyword, ...) records into one list per shard."""
+    parts = [[] for _ in names]
+    for record in records:
+        parts[shard_for(record[0], names)].append(record)
+
+    return parts
+
+
+class ShardedPool:
+    """One connection pool per shard, queries fan out to all of them. `names` are the shard ids."""
+
+    def __init__(self, pools, names):
+        self.pools = pools
+        self.names = names
+
+    def __len__(self):
+        return len(self.pools)
+
+    async def run(self, fn, *args):
+        """Runs `fn(conn, *args)` on every shard concurrently, results in shard order."""
+
+        async def _run(pool):
+            async with acquire(pool) as conn:
+                return await fn(conn, *args)
+
+        return await asyncio.gather(*[_run(pool) for pool in self.pools])
+
+    def iterate(self, fn, *args):
+        """One async iterator per shard over `fn(conn, *args)`, each holding a connection."""
+
+        async def _iterate(pool):
+            async with acquire(pool) as conn:
+                async for item in fn(conn, *args):
+                    yield item
+
+        return [_iterate(pool) for pool in self.pools]
+
+    async def close(self):
+        for name in self.names:
+            METRICS.unregister_gauges(pool=name)
+        await asyncio.gather(*[pool.close() for pool in self.pools])
+
+
+async def create_sharded_pool(min_size=10, max_size=10, shards=None):
+    params = shard_params(shards)
+    pools = await asyncio.gather(
+        *[
+            asyncpg.create_pool(
+                min_size=min_size,
+                max_size=max_size,
+                connection_class=SearchConnection,
+                **shard,
+            )
+            for _, shard in params
+        ]
+    )
+    names = [shard_id for shard_id, _ in params]
+    for pool, name in zip(pools, names):
+        register_pool_gauges(pool, name)
+
+    return ShardedPool(list(pools), names)
+
+
+@asynccontextmanager
+async def get_sharded_pool(min_size=10, max_size=10, shards=None):
+    pool = await create_sharded_pool(min_size, max_size, shards)
+
+    yield pool
+
+    await pool.close()
+
+
+def shard_columns(columns):
+    """Columns to fetch from every shard, merging needs the keyword and volume."""
+    return (*columns, *[col for col in ("keyword", "volume") if col not in columns])
+
+
+def by_volume(r):
+    return -r["volume"]
+
+
+def merge_top(results, total_keywords):
+    """
+    Global top k from the per shard top k, each ordered by volume desc. A
+    keyword on two shards, mid rebalance, is only returned once.
+    """
+    seen = set()
+    unique = (
+        r
+        for r in heapq.merge(*results, key=by_volume)
+        if r["keyword"] not in seen and not seen.add(r["keyword"])
+    )
+    return list(islice(unique, total_keywords))
+
+
+async def merge_sorted(iterators, key=by_volume, batch_size=1000):
+    """
+    k-way heap merge of async iterators of row batches, each sorted by `key`.
+    Only the current batch of every iterator is held, the next one is fetched
+    when the heap drains it.
+    """
+    iterators = [iterator.__aiter__() for iterator in iterators]
+
+    async def _next(i):
+        try:
+            return await iterators[i].__anext__()
+        except StopAsyncIteration:
+            return None
+
+    try:
+        batches = list(await asyncio.gather(*[_next(i) for i in range(len(iterators))]))
+        heap = [(key(batch[0]), i, 0) for i, batch in enumerate(batches) if batch]
+        heapq.heapify(heap)
+
+        merged = []
+        while heap:
+            _, i, position = heap[0]
+            merged.append(batches[i][position])
+            position += 1
+            if position == len(batches[i]):
+                batches[i] = await _next(i)
+                position = 0
+
+            if batches[i]:
+                heapq.heapreplace(heap, (key(batches[i][position]), i, position))
+            else:
+                heapq.heappop(heap)
+
+            if len(merged) >= batch_size:
+                yield merged
+                merged = []
+
+        if merged:
+            yield merged
+    finally:
+        for iterator in iterators:
+            await iterator.aclose()
+
+
+async def copy_range_sharded(pool, file_range, progress, batch_size):
+    file_path, start, end = file_range
+    header = read_header(file_path)
+    columns = [col for col in header if col in COLUMN_TYPES]
+    if columns != header:
+        raise ValueError(f"Unknown columns in {file_path}: {header}")
+    if header[0] != "keyword":
+        raise ValueError(f"{file_path} has to start with the keyword column")
+
+    async def _copy(shard_pool, records):
+        if records:
+            async with shard_pool.acquire() as conn:
+                await conn.copy_records_to_table(TABLE_NAME, records=records, columns=columns)
+
+    rows = csv.reader(read_lines(file_path, start, end))
+    while True:
+        batch = await asyncio.to_thread(read_batch, rows, header, batch_size)
+        if not batch:
+            return
+
+        parts = await asyncio.to_thread(partition, batch, pool.names)
+        await asyncio.gather(*[_copy(p, records) for p, records in zip(pool.pools, parts)])
+        progress.rows += len(batch)
+
+
+async def rebuild_top_keywords(pool):
+    tokens = await pool.run(build_top_keywords)
+    for name, count in zip(pool.names, tokens):
+        print(f"Built top keywords for {count} tokens on {name}")
+
+
+async def load(file_paths, workers=4, batch_size=50000, shards=None):
+    """
+    Copies csv files into adwords_en_us, every keyword to the shard owning it.
+    The top keywords triggers are disabled during the load and the table is
+    rebuilt on every shard at the end.
+    """
+    file_ranges = [
+        file_range
+        for file_path in file_paths
+        for file_range in split_file(file_path, workers)
+    ]
+    progress = Progress()
+
+    async with get_sharded_pool(min_size=1, max_size=workers, shards=shards) as pool:
+        await pool.run(lambda conn: conn.execute(f"alter table {TABLE_NAME} disable trigger user"))
+
+        semaphore = asyncio.Semaphore(workers)
+
+        async def _copy(file_range):
+            async with semaphore:
+                await copy_range_sharded(pool, file_range, progress, batch_size)
+
+        reporter = asyncio.create_task(progress.report())
+        try:
+            await asyncio.gather(*[_copy(file_range) for file_range in file_ranges])
+        finally:
+            reporter.cancel()
+            await pool.run(lambda conn: conn.execute(f"alter table {TABLE_NAME} enable trigger user"))
+
+        print(f"Loaded {progress.rows} rows over {len(pool)} shards, {progress.rows_per_sec:.0f} rows/sec")
+        await rebuild_top_keywords(pool)
+
+    return progress.rows
+
+
+# Moved rows go through a temp table, so copying rows the target already has,
+# left by a failed rebalance, doesn't fail on the primary key
+MOVE_TABLE_QUERY = f"""
+    create temp table rebalance_rows (like {TABLE_NAME} excluding all) on commit drop;
+"""
+
+INSERT_MOVED_QUERY = f"""
+    insert into {TABLE_NAME} ({", ".join(COLUMN_TYPES)})
+    select {", ".join(COLUMN_TYPES)} from rebalance_rows
+    on conflict (keyword) do nothing;
+"""
+
+
+async def copy_moved_rows(conn, records, columns):
+    async with conn.transaction():
+        await conn.execute(MOVE_TABLE_QUERY)
+        await conn.copy_records_to_table("rebalance_rows", records=records, columns=columns)
+        await conn.execute(INSERT_MOVED_QUERY)
+
+
+async def move_rows(pool, source, batch_size):
+    """Moves the rows of shard `source` owned by another shard, returns how many moved."""
+    columns = list(COLUMN_TYPES)
+    moved = 0
+    async with pool.pools[source].acquire() as conn:
+        async with conn.transaction():
+            cursor = await conn.cursor(f"select {', '.join(columns)} from {TABLE_NAME}")
+            while True:
+                rows = await cursor.fetch(batch_size)
+                if not rows:
+                    return moved
+
+                parts = partition([tuple(r) for r in rows], pool.names)
+                for target, records in enumerate(parts):
+                    if target == source or not records:
+                        continue
+                    async with pool.pools[target].acquire() as target_conn:
+                        await copy_moved_rows(target_conn, records, columns)
+                    await conn.execute(
+                        f"delete from {TABLE_NAME} where keyword = any($1::text[])",
+                        [r[0] for r in records],
+                    )
+                    moved += len(records)
+
+
+async def rebalance(batch_size=10000, shards=None):
+    """
+    Moves every keyword to the shard owning it, run after adding shards to
+    DB_SHARDS. Each source shard is moved in a single transaction, a failure
+    leaves the copied rows on the target and the source intact. Searches
+    return them once, and rerunning skips the rows the target already has.
+    """
+    async with get_sharded_pool(min_size=1, max_size=2, shards=shards) as pool:
+        for source, name in enumerate(pool.names):
+            t1 = time.perf_counter()
+            moved = await move_rows(pool, source, batch_size)
+            print(f"Moved {moved} rows off {name} in {time.perf_counter() - t1}")
+
+        await rebuild_top_keywords(pool)
+
+
+def cli():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    load_parser = subparsers.add_parser("load", help="Load csv files over the shards")
+    load_parser.add_argument("file_paths", nargs="+", help="Keyword csv files")
+    load_parser.add_argument("--workers", type=int, help="Parallel file ranges", default=4)
+    load_parser.add_argument("--batch_size", type=int, help="Rows per COPY", default=50000)
+
+    rebalance_parser = subparsers.add_parser(
+        "rebalance", help="Move keywords to their shard after adding shards"
+    )
+    rebalance_parser.add_argument("--batch_size", type=int, help="Rows per move", default=10000)
+
+    args = parser.parse_args()
+    if args.command == "load":
+        asyncio.run(load(args.file_paths, args.workers, args.batch_size))
+    else:
+        asyncio.run(rebalance(args.batch_size))
+
+
+if __name__ == "__main__":
+    """
+    DB_SHARDS=shard1=localhost:5441,shard2=localhost:5442,shard3=localhost:5443 python -m fts_postgres.shards load seed_data/*.csv
+    """
+    cli()
@@ -0,0 +1,151 @@
+import asyncio
+import time
+
+from fts_postgres.pg_client import db_connection, db_params
+from fts_postgres.queries import tsquery_function
+
+TOP_KEYWORDS_SIZE = 1000
+
+BUILD_QUERY = """
+    with ranked as (
+        select token, keyword, volume,
+               row_number() over (partition by token order by volume desc, keyword) as rank,
+               count(*) over (partition by token) as match_count
+        from adwords_en_us, unnest(tsvector_to_array(keyword_tsv)) as token
+        where spell_type is null
+    )
+    insert into adwords_en_us_top_keywords (token, match_count, keywords, volumes)
+    select token, max(match_count), array_agg(keyword order by rank), array_agg(volume order by rank)
+    from ranked
+    where rank <= $1
+    group by token;
+"""
+
+REFRESH_QUERY = """
+    insert into adwords_en_us_top_keywords (token, match_count, keywords, volumes)
+    select stale.token, m.match_count, m.keywords, m.volumes
+    from unnest($2::text[]) as stale(token)
+    cross join lateral (
+        select count(*) as match_count,
+               (array_agg(keyword order by volume desc, keyword))[1:$1] as keywords,
+               (array_agg(volume order by volume desc, keyword))[1:$1] as volumes
+        from adwords_en_us
+        where keyword_tsv @@ quote_literal(stale.token)::tsquery
+        and spell_type is null
+    ) m
+    where m.match_count > 0;
+"""
+
+LOOKUP_QUERY = """
+    with lexemes as (
+        select unnest(tsvector_to_array(to_tsvector('english', $1))) as token
+    )
+    select l.token, t.match_count, t.keywords, t.volumes,
+           exists(select 1 from adwords_en_us_top_keywords_stale s where s.token = l.token) as is_stale
+    from lexemes l
+    left join adwords_en_us_top_keywords t using (token);
+"""
+
+FILTER_QUERY = """
+    select keyword, volume
+    from adwords_en_us
+    where keyword = any($1::text[])
+    and keyword_tsv @@ {tsquery_function}('english', $2)
+    order by volume desc
+    limit $3;
+"""
+
+
+async def build_top_keywords(conn, top_size=TOP_KEYWORDS_SIZE):
+    async with conn.transaction():
+        await conn.execute("truncate adwords_en_us_top_keywords_stale")
+        await conn.execute("truncate adwords_en_us_top_keywords")
+        await conn.execute(BUILD_QUERY, top_size)
+
+    return await conn.fetchval("select count(*) from adwords_en_us_top_keywords")
+
+
+async def refresh_top_keywords(conn, top_size=TOP_KEYWORDS_SIZE, batch_size=500):
+    """Rebuilds only the tokens marked stale by the adwords_en_us triggers."""
+    refreshed = 0
+    while True:
+        async with conn.transaction():
+            tokens = await conn.fetch(
+                """
+                delete from adwords_en_us_top_keywords_stale
+                where token in (
+                    select token from adwords_en_us_top_keywords_stale
+                    limit $1 for update skip locked
+                )
+                returning token;
+                """,
+                batch_size,
+            )
+            if not tokens:
+                return refreshed
+
+            tokens = [r["token"] for r in tokens]
+            await conn.execute(
+                "delete from adwords_en_us_top_keywords where token = any($1::text[])",
+                tokens,
+            )
+            await conn.execute(REFRESH_QUERY, top_size, tokens)
+            refreshed += len(tokens)
+
+
+async def search_top_keywords(conn, term, columns, search_type, total_keywords):
+    """
+    Answers a search from adwords_en_us_top_keywords. Returns None when the
+    table can't answer it and the caller has to run the full text search.
+    """
+    if not set(columns) <= {"keyword", "volume"}:
+        return None
+
+    lexemes = await conn.fetch_prepared(LOOKUP_QUERY, term)
+    if not lexemes:
+        return []
+    if any(r["is_stale"] for r in lexemes):
+        return None
+    if any(r["match_count"] is None for r in lexemes):
+        # Unknown lexeme, or rows written before the table was built or with the
+        # triggers disabled: the GIN index answers it cheaply either way
+        return None
+
+    rarest = min(lexemes, key=lambda r: r["match_count"])
+    is_complete = rarest["match_count"] <= len(rarest["keywords"])
+
+    if len(lexemes) == 1 and len(term.split(" ")) == 1:
+        if total_keywords > len(rarest["keywords"]) and not is_complete:
+            return None
+        return [
+            {"keyword": keyword, "volume": volume}
+            for keyword, volume in zip(
+                rarest["keywords"][:total_keywords], rarest["volumes"][:total_keywords]
+            )
+        ]
+
+    if not is_complete:
+        return None
+
+    query = FILTER_QUERY.format(tsquery_function=tsquery_function(search_type))
+    result = await conn.fetch_prepared(query, rarest["keywords"], term, total_keywords)
+    return [dict(r) for r in result]
+
+
+async def main():
+    async with db_connection(**db_params) as conn:
+        t1 = time.perf_counter()
+        is_empty = await conn.fetchval(
+            "select not exists (select 1 from adwords_en_us_top_keywords)"
+        )
+        if is_empty:
+            tokens = await build_top_keywords(conn)
+            print(f"Built top keywords for {tokens} tokens")
+        else:
+            tokens = await refresh_top_keywords(conn)
+            print(f"Refreshed top keywords for {tokens} stale tokens")
+        print(f"Time taken: {time.perf_counter() - t1}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
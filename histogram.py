@@ -0,0 +1,101 @@
+from collections import defaultdict
+
+# 2**7 sub buckets per power of two keeps every recorded value within 1%
+SUB_BUCKET_BITS = 7
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+
+
+def bucket_index(value):
+    """Values under SUB_BUCKETS are exact, the others keep their top 8 bits."""
+    if value < SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS - 1
+    # value >> shift is in [SUB_BUCKETS, 2 * SUB_BUCKETS)
+    return (shift << SUB_BUCKET_BITS) + (value >> shift)
+
+
+def bucket_upper_value(index):
+    if index < SUB_BUCKETS:
+        return index
+    shift = (index >> SUB_BUCKET_BITS) - 1
+    sub_bucket = (index & (SUB_BUCKETS - 1)) + SUB_BUCKETS
+    return ((sub_bucket + 1) << shift) - 1
+
+
+class LatencyHistogram:
+    """
+    HDR style histogram of latencies in microseconds, log-linear buckets so
+    recording is O(1) and the memory doesn't grow with the number of samples.
+    """
+
+    def __init__(self):
+        self.counts = defaultdict(int)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def record(self, seconds):
+        self.record_value(int(seconds * 1_000_000))
+
+    def record_value(self, value):
+        self.counts[bucket_index(value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        for index, count in other.counts.items():
+            self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        if other.count:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+        return self
+
+    def percentile(self, percentile):
+        """Value in microseconds at or below which `percentile` % of the samples fall."""
+        if not self.count:
+            return None
+
+        rank = max(1, round(self.count * percentile / 100))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(bucket_upper_value(index), self.max)
+        return self.max
+
+    def summary(self, percentiles=(50, 90, 99, 99.9)):
+        """Latencies in milliseconds."""
+        summary = {
+            "count": self.count,
+            "min": self.min / 1000 if self.count else None,
+            "mean": self.total / self.count / 1000 if self.count else None,
+            "max": self.max / 1000 if self.count else None,
+        }
+        for p in percentiles:
+            value = self.percentile(p)
+            summary[f"p{p:g}"] = value / 1000 if value is not None else None
+        return summary
+
+    def to_dict(self):
+        return {
+            "counts": dict(self.counts),
+            "count": self.count,
+            "total": self.total,
+            "min": self.min,
+            "max": self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls()
+        histogram.counts.update({int(index): count for index, count in data["counts"].items()})
+        histogram.count = data["count"]
+        histogram.total = data["total"]
+        histogram.min = data["min"]
+        histogram.max = data["max"]
+        return histogram
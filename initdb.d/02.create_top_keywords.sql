@@ -0,0 +1,46 @@
+-- Top keywords by volume for every lexeme of adwords_en_us (spell_type is null),
+-- built and refreshed by fts_postgres/top_keywords.py
+create table adwords_en_us_top_keywords (
+    token text primary key,
+    match_count int not null,
+    keywords text[] not null,
+    volumes int[] not null
+);
+
+-- Lexemes whose keywords changed since the last refresh
+create table adwords_en_us_top_keywords_stale (
+    token text primary key
+);
+
+create function adwords_en_us_mark_stale_tokens() returns trigger as $$
+begin
+    if tg_op in ('INSERT', 'UPDATE') then
+        insert into adwords_en_us_top_keywords_stale (token)
+        select distinct unnest(tsvector_to_array(keyword_tsv)) from new_rows
+        on conflict do nothing;
+    end if;
+
+    if tg_op in ('UPDATE', 'DELETE') then
+        insert into adwords_en_us_top_keywords_stale (token)
+        select distinct unnest(tsvector_to_array(keyword_tsv)) from old_rows
+        on conflict do nothing;
+    end if;
+
+    return null;
+end;
+$$ language plpgsql;
+
+create trigger adwords_en_us_insert_stale_tokens
+    after insert on adwords_en_us
+    referencing new table as new_rows
+    for each statement execute function adwords_en_us_mark_stale_tokens();
+
+create trigger adwords_en_us_update_stale_tokens
+    after update on adwords_en_us
+    referencing old table as old_rows new table as new_rows
+    for each statement execute function adwords_en_us_mark_stale_tokens();
+
+create trigger adwords_en_us_delete_stale_tokens
+    after delete on adwords_en_us
+    referencing old table as old_rows
+    for each statement execute function adwords_en_us_mark_stale_tokens();
@@ -0,0 +1,10 @@
+-- Snapshot of the new keywords, copied and diffed against adwords_en_us by
+-- fts_postgres/refresh.py. Unlogged and without keyword_tsv, so loading it
+-- writes no WAL and computes no tsvector.
+create unlogged table adwords_en_us_staging (
+    keyword text primary key,
+    volume int not null,
+    cpc float default  0.0,
+    competition float default  0.0,
+    spell_type varchar(32)
+);
@@ -0,0 +1,43 @@
+import asyncio
+import itertools
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+async def run_adaptive(fetch, queries, limiter, duration):
+    """
+    Closed loop whose concurrency is set by `limiter`: a request starts as
+    soon as the limiter has a free slot, and the limiter moves its limit with
+    the observed p99 and errors. Returns the limiter's per window history.
+
+    `fetch` returns a `time_tracker` tuple, its third item is the error flag.
+    """
+    loop = asyncio.get_running_loop()
+    started_at = loop.time()
+    tasks = set()
+
+    async def _request(query):
+        t1 = time.perf_counter()
+        is_error = True
+        try:
+            is_error = (await fetch(query))[2]
+        except Exception as error:
+            logger.error(str(error))
+        finally:
+            limiter.release(time.perf_counter() - t1, is_error)
+
+    for query in itertools.cycle(queries):
+        if loop.time() - started_at >= duration:
+            break
+        await limiter.acquire()
+
+        task = asyncio.create_task(_request(query))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    if tasks:
+        await asyncio.gather(*tasks)
+
+    return limiter.history
@@ -4,13 +4,22 @@ import json
 import logging
 import os.path
 import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from itertools import groupby
+from typing import NamedTuple
 
-import asyncpg
 import boto3
 import pandas as pd
 from dotenv import load_dotenv
 
+from concurrency import ConcurrencyLimiter
+from load_tests.adaptive import run_adaptive
+from load_tests.backends import BACKENDS
+from load_tests.open_loop import OpenLoopResult, run_open_loop
+from locales import Locale, locale_for
+from metrics import METRICS
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -50,14 +59,40 @@ def read_queries(file_name="topics.json"):
     ]
 
 
+class Query(NamedTuple):
+    term: str
+    locale: Locale
+
+
+def read_search_queries(file_name="topics.json"):
+    """Every query's term with the locale of its own country and language."""
+    return [
+        Query(query["term"], locale_for(query["country"], query["language"]))
+        for query in read_queries(file_name)
+    ]
+
+
 def chunks(terms, chunk_size=5000):
     for i in range(0, len(terms), chunk_size):
         yield terms[i : i + chunk_size]
 
 
-def convert_term_to_tsvector_for_search(term, opr="&"):
-    split_term = term.split(" ")
-    return opr.join(split_term)
+def locale_batches(queries, batch_size):
+    """(terms, locale) batches of up to `batch_size` queries of the same locale."""
+    by_locale = groupby(sorted(queries, key=lambda query: query.locale), key=lambda query: query.locale)
+    for locale, locale_queries in by_locale:
+        for batch in chunks([query.term for query in locale_queries], batch_size):
+            yield batch, locale
+
+
+def with_locale(fetch):
+    """Calls `fetch(term, locale=locale)` with a (term, locale) item, terms for batches."""
+
+    async def _fetch(item):
+        term, locale = item
+        return await fetch(term, locale=locale)
+
+    return _fetch
 
 
 def ts_to_date(ts):
@@ -80,41 +115,16 @@ def time_tracker(func):
     return _func
 
 
-@time_tracker
-async def fetch_from_postgresql(term, opr="&", pool=None):
-    if not pool:
-        raise Exception("Connection pool not provided")
+sources = BACKENDS
 
-    term = convert_term_to_tsvector_for_search(term, opr)
-    result = None
-    is_error = True
+batch_sources = {"postgresql_batch"}
 
-    try:
-        query = f"""
-            with matched_keywords as (
-                select *
-                from adwords_en_us
-                where keyword_tsv @@ to_tsquery('{term}')
-            )
-            select keyword, volume
-            from matched_keywords
-            where spell_type is null
-            order by volume desc
-            limit 1000;
-        """
-        async with pool.acquire() as con:
-            result = await con.fetch(query)
-            result = len(result)
-            is_error = False
-    except Exception as error:
-        logger.error(str(error))
-
-    return result, is_error
-
-
-sources = {
-    "postgresql": fetch_from_postgresql,
-}
+
+async def create_backend(source, pool_size, queries, warm_up_terms=10):
+    backend = sources.get(source)(pool_size, db_params=db_params)
+    await backend.connect()
+    await backend.warm_up(queries[:warm_up_terms])
+    return backend
 
 
 def save_stats(results, load_type, source):
@@ -128,46 +138,260 @@ def save_stats(results, load_type, source):
     df.to_csv(results_file_name, index=False)
     df['time_took'].describe().to_csv(stats_file_name)
 
-    # Upload to s3
+    upload_to_s3([results_file_name, stats_file_name])
+
+
+def save_open_loop_stats(result, load_type, source):
+    file_name_prefix = f"{source}_{load_type}_open_loop"
+    latency_file_name = f"{file_name_prefix}_latency.csv"
+    timeline_file_name = f"{file_name_prefix}_timeline.csv"
+
+    # Latency percentiles in ms and per second throughput/errors
+    pd.Series(result.histogram.summary()).to_csv(latency_file_name)
+    pd.DataFrame(result.timeline_rows()).to_csv(timeline_file_name, index=False)
+
+    upload_to_s3([latency_file_name, timeline_file_name])
+
+
+def save_metrics(load_type, source, suffix=""):
+    """Per stage latencies and gauges collected by `metrics.METRICS` during the run."""
+    metrics_file_name = f"{source}_{load_type}{suffix}_metrics.json"
+    with open(metrics_file_name, "w") as f:
+        f.write(METRICS.to_json())
+
+    upload_to_s3([metrics_file_name])
+
+
+async def start_metrics_server(metrics_port):
+    if metrics_port is None:
+        return None
+    server = await METRICS.serve(port=metrics_port)
+    logger.info(f"Serving metrics on :{metrics_port}/metrics and /metrics.json")
+    return server
+
+
+def save_adaptive_stats(history, load_type, source):
+    history_file_name = f"{source}_{load_type}_adaptive_windows.csv"
+    pd.DataFrame(history).to_csv(history_file_name, index=False)
+
+    upload_to_s3([history_file_name])
+
+
+def upload_to_s3(file_names):
     s3 = boto3.resource("s3")
-    for f in [results_file_name, stats_file_name]:
+    for f in file_names:
         s3.meta.client.upload_file(f, os.getenv("BUCKET_NAME"), f"load_tests/{f}")
         os.remove(f)
 
 
-async def run_test(source, load_type):
+async def collect_results(source, queries, queries_to_run, batch_size=50):
+    """
+    Closed loop, runs the queries in chunks of `queries_to_run` concurrent
+    queries. Batch sources get batches of one locale's terms.
+    """
     results = []
+    is_batch = source in batch_sources
+    pool_size = -(-queries_to_run // batch_size) if is_batch else queries_to_run
+    backend = await create_backend(source, pool_size, queries)
+    fetch = time_tracker(with_locale(backend.fetch_batch if is_batch else backend.fetch))
+
+    try:
+        for chunk_queries in chunks(queries, queries_to_run):
+            logger.info(f"Processing {len(chunk_queries)} terms")
+            if is_batch:
+                items = list(locale_batches(chunk_queries, batch_size))
+            else:
+                items = chunk_queries
+            tasks = [fetch(item) for item in items]
+            logger.info(f"Task Build {len(chunk_queries)}")
+            result = await asyncio.gather(*tasks)
+
+            for r in result:
+                terms, locale = r[0]
+                term_results = (r[1] or {}) if is_batch else {terms: r[1]}
+                for term in terms if is_batch else [terms]:
+                    results.append(
+                        dict(
+                            term=term,
+                            locale=locale.name,
+                            result=term_results.get(term),
+                            error=r[2],
+                            time_took=r[3],
+                            request_start_time=r[4],
+                            request_end_time=r[5],
+                        )
+                    )
+    finally:
+        await backend.close()
+
+    return results
+
+
+async def collect_open_loop(
+    source, queries, max_in_flight, rate, duration, ramp_to=None, start_at=None
+):
+    backend = await create_backend(source, max_in_flight, queries)
+    if start_at is not None:
+        await asyncio.sleep(max(0, start_at - time.time()))
+
+    try:
+        result = await run_open_loop(
+            time_tracker(with_locale(backend.fetch)), queries, rate, duration, ramp_to
+        )
+    finally:
+        await backend.close()
+
+    return result
+
+
+async def run_test(source, load_type, batch_size=50, metrics_port=None):
     queries_to_run = load_type_config.get(load_type)
-    queries = read_queries()
-    terms = [query.get("term") for query in queries]
+    queries = read_search_queries()
 
-    pool = (
-        await asyncpg.create_pool(min_size=50, max_size=queries_to_run,  **db_params)
-        if source == "postgresql"
-        else None
+    logger.info(f"Processing for: {load_type} from source: {source}")
+    server = await start_metrics_server(metrics_port)
+    try:
+        results = await collect_results(source, queries, queries_to_run, batch_size)
+    finally:
+        if server is not None:
+            server.close()
+    save_stats(results, load_type, source)
+    save_metrics(load_type, source)
+    logger.info(
+        f"Load testing done for source: {source} and load_type: {load_type}"
     )
 
-    logger.info(f"Processing for: {load_type} from source: {source}")
-    for chunk_terms in chunks(terms, queries_to_run):
-        logger.info(f"Processing {len(chunk_terms)} terms")
-        tasks = []
-        for term in chunk_terms:
-            tasks.append(sources.get(source)(term, pool=pool))
-        logger.info(f"Task Build {len(chunk_terms)}")
-        result = await asyncio.gather(*tasks)
-
-        for r in result:
-            results.append(
-                dict(
-                    term=r[0],
-                    result=r[1],
-                    error=r[2],
-                    time_took=r[3],
-                    request_start_time=r[4],
-                    request_end_time=r[5],
+
+async def run_open_loop_test(
+    source, load_type, rate, duration, ramp_to=None, metrics_port=None
+):
+    max_in_flight = load_type_config.get(load_type)
+    queries = read_search_queries()
+
+    logger.info(
+        f"Open loop for: {load_type} from source: {source}, "
+        f"{rate} -> {ramp_to or rate} requests/sec for {duration}s"
+    )
+    server = await start_metrics_server(metrics_port)
+    try:
+        result = await collect_open_loop(
+            source, queries, max_in_flight, rate, duration, ramp_to
+        )
+    finally:
+        if server is not None:
+            server.close()
+
+    logger.info(f"Latency (ms): {result.histogram.summary()}")
+    save_open_loop_stats(result, load_type, source)
+    save_metrics(load_type, source, "_open_loop")
+
+
+async def run_adaptive_test(
+    source, load_type, duration, target_p99, max_error_rate=0.01, metrics_port=None
+):
+    """
+    Lets a `ConcurrencyLimiter` find the concurrency, up to the load type's,
+    at which the p99 stays under `target_p99` seconds, and reports the best
+    throughput it sustained.
+    """
+    max_in_flight = load_type_config.get(load_type)
+    queries = read_search_queries()
+
+    logger.info(
+        f"Adaptive for: {load_type} from source: {source}, "
+        f"p99 target {target_p99 * 1000}ms for {duration}s"
+    )
+    server = await start_metrics_server(metrics_port)
+    backend = await create_backend(source, max_in_flight, queries)
+    limiter = ConcurrencyLimiter(
+        initial_limit=1,
+        max_limit=max_in_flight,
+        target_p99=target_p99,
+        max_error_rate=max_error_rate,
+        name=source,
+    )
+    try:
+        history = await run_adaptive(
+            time_tracker(with_locale(backend.fetch)), queries, limiter, duration
+        )
+    finally:
+        await backend.close()
+        limiter.close()
+        if server is not None:
+            server.close()
+
+    best = limiter.max_sustainable()
+    if best is None:
+        logger.info("No window met the p99 and error rate targets")
+    else:
+        logger.info(
+            f"Max sustainable: {best['qps']:.1f} requests/sec at {best['limit']} in flight, "
+            f"p99 {best['p99_ms']:.1f}ms"
+        )
+    save_adaptive_stats(history, load_type, source)
+    save_metrics(load_type, source, "_adaptive")
+
+
+def closed_loop_worker(source, queries, queries_to_run, batch_size):
+    return asyncio.run(collect_results(source, queries, queries_to_run, batch_size))
+
+
+def open_loop_worker(source, queries, max_in_flight, rate, duration, ramp_to, start_at):
+    result = asyncio.run(
+        collect_open_loop(
+            source, queries, max_in_flight, rate, duration, ramp_to, start_at
+        )
+    )
+    return result.to_dict()
+
+
+def run_multiprocess_test(
+    source, load_type, processes, mode, batch_size=50, rate=100, duration=60, ramp_to=None
+):
+    """
+    Splits the queries and the load across worker processes, each with its own
+    event loop and pool, then merges their results into one report.
+    """
+    queries_to_run = max(1, load_type_config.get(load_type) // processes)
+    queries = read_search_queries()
+    process_queries = [queries[i::processes] for i in range(processes)]
+
+    logger.info(
+        f"Processing for: {load_type} from source: {source} in {processes} processes"
+    )
+    with ProcessPoolExecutor(processes) as executor:
+        if mode == "open_loop":
+            # Workers start sending together, once all pools are created
+            start_at = time.time() + 5
+            futures = [
+                executor.submit(
+                    open_loop_worker,
+                    source,
+                    worker_queries,
+                    queries_to_run,
+                    rate / processes,
+                    duration,
+                    ramp_to / processes if ramp_to else None,
+                    start_at,
                 )
-            )
-    save_stats(results, load_type, source)
+                for worker_queries in process_queries
+            ]
+            result = OpenLoopResult()
+            for future in futures:
+                result.merge(OpenLoopResult.from_dict(future.result()))
+
+            logger.info(f"Latency (ms): {result.histogram.summary()}")
+            save_open_loop_stats(result, load_type, source)
+        else:
+            futures = [
+                executor.submit(
+                    closed_loop_worker, source, worker_queries, queries_to_run, batch_size
+                )
+                for worker_queries in process_queries
+            ]
+            results = [row for future in futures for row in future.result()]
+            save_stats(results, load_type, source)
+
     logger.info(
         f"Load testing done for source: {source} and load_type: {load_type}"
     )
@@ -187,14 +411,83 @@ def cli():
         type=str,
         help="Load testing type",
         default="postgresql",
-        choices=["postgresql", "elastic_search"],
+        choices=list(sources),
+    )
+    parser.add_argument(
+        "--mode",
+        type=str,
+        help=(
+            "closed_loop runs chunks of load_type queries, open_loop sends at a fixed rate, "
+            "adaptive searches the concurrency (up to load_type's) meeting --target_p99"
+        ),
+        default="closed_loop",
+        choices=["closed_loop", "open_loop", "adaptive"],
+    )
+    parser.add_argument("--rate", type=float, help="Open loop requests/sec", default=100)
+    parser.add_argument("--ramp_to", type=float, help="Open loop requests/sec at the end", default=None)
+    parser.add_argument("--duration", type=float, help="Open loop and adaptive seconds", default=60)
+    parser.add_argument("--target_p99", type=float, help="Adaptive p99 target in ms", default=100)
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        help="Terms per statement for batch sources",
+        default=50,
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        help="Worker processes generating the load",
+        default=1,
+    )
+    parser.add_argument(
+        "--metrics_port",
+        type=int,
+        help="Serve per stage metrics on this port while the test runs (single process only)",
+        default=None,
     )
     args = parser.parse_args()
-    asyncio.run(run_test(args.source, args.load_type))
+    if args.mode == "adaptive":
+        if args.processes > 1:
+            parser.error("adaptive mode runs in a single process")
+        asyncio.run(
+            run_adaptive_test(
+                args.source,
+                args.load_type,
+                args.duration,
+                args.target_p99 / 1000,
+                metrics_port=args.metrics_port,
+            )
+        )
+    elif args.processes > 1:
+        run_multiprocess_test(
+            args.source,
+            args.load_type,
+            args.processes,
+            args.mode,
+            args.batch_size,
+            args.rate,
+            args.duration,
+            args.ramp_to,
+        )
+    elif args.mode == "open_loop":
+        asyncio.run(
+            run_open_loop_test(
+                args.source,
+                args.load_type,
+                args.rate,
+                args.duration,
+                args.ramp_to,
+                args.metrics_port,
+            )
+        )
+    else:
+        asyncio.run(
+            run_test(args.source, args.load_type, args.batch_size, args.metrics_port)
+        )
 
 
 if __name__ == "__main__":
     """
-    nohup python -m adwords_load_test --load_type small  > load-testing_small.out 2>&1 &
+    nohup python -m load_tests.adwords_load_test --load_type small  > load-testing_small.out 2>&1 &
     """
     cli()
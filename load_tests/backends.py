@@ -0,0 +1,213 @@
+import logging
+
+import asyncpg
+
+from fts_elastic.es_client import create_es_client
+from fts_elastic.hedging import create_hedged_client
+from fts_elastic.search_data import search_keywords_lean
+from fts_memory.corpus import load_index
+from fts_postgres.pg_client import SearchConnection, acquire, db_params as pg_db_params
+from fts_postgres.queries import search_keywords, search_keywords_batch
+from fts_postgres.shards import create_sharded_pool, merge_top
+from locales import DEFAULT_LOCALE
+from metrics import METRICS, register_pool_gauges, span
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ["keyword", "volume"]
+
+
+class Backend:
+    """
+    A load test source. The client is created once in `connect`, shared by
+    every query and closed at the end of the run. Every query is routed to
+    its own `locale`.
+    """
+
+    def __init__(self, pool_size, **kwargs):
+        self.pool_size = pool_size
+
+    async def connect(self):
+        pass
+
+    async def warm_up(self, queries, search_type="broad"):
+        """`queries` are (term, locale) pairs."""
+        for term, locale in queries:
+            await self.query(term, search_type, locale)
+
+    async def search(self, term, search_type="broad", total_keywords=1000, locale=DEFAULT_LOCALE):
+        """Returns (keyword, volume) pairs ordered by volume desc."""
+        raise NotImplementedError
+
+    async def query(self, term, search_type="broad", locale=DEFAULT_LOCALE):
+        """Returns the number of keywords found for the term."""
+        return len(await self.search(term, search_type, locale=locale))
+
+    async def close(self):
+        pass
+
+    async def fetch(self, term, search_type="broad", locale=DEFAULT_LOCALE):
+        result = None
+        is_error = True
+
+        try:
+            result = await self.query(term, search_type, locale)
+            is_error = False
+        except Exception as error:
+            logger.error(str(error))
+
+        return result, is_error
+
+
+class PostgresBackend(Backend):
+    def __init__(self, pool_size, db_params=None, **kwargs):
+        super().__init__(pool_size)
+        self.db_params = db_params or pg_db_params
+        self.pool = None
+
+    async def connect(self):
+        self.pool = await asyncpg.create_pool(
+            min_size=min(50, self.pool_size),
+            max_size=self.pool_size,
+            connection_class=SearchConnection,
+            **self.db_params,
+        )
+        register_pool_gauges(self.pool, "pg")
+
+    async def search(self, term, search_type="broad", total_keywords=1000, locale=DEFAULT_LOCALE):
+        async with acquire(self.pool) as con:
+            with span("pg.query"):
+                result = await search_keywords(
+                    con, term, COLUMNS, search_type, total_keywords, locale
+                )
+        return [(r["keyword"], r["volume"]) for r in result]
+
+    async def close(self):
+        if self.pool is not None:
+            METRICS.unregister_gauges(pool="pg")
+            await self.pool.close()
+
+
+class PostgresBatchBackend(PostgresBackend):
+    async def search(self, term, search_type="broad", total_keywords=1000, locale=DEFAULT_LOCALE):
+        return (await self.search_batch([term], search_type, total_keywords, locale))[term]
+
+    async def search_batch(
+        self, terms, search_type="broad", total_keywords=1000, locale=DEFAULT_LOCALE
+    ):
+        async with acquire(self.pool) as con:
+            with span("pg.query_batch"):
+                results = await search_keywords_batch(
+                    con, terms, COLUMNS, search_type, total_keywords, locale
+                )
+        return {
+            term: [(r["keyword"], r["volume"]) for r in rows]
+            for term, rows in results.items()
+        }
+
+    async def query_batch(self, terms, search_type="broad", locale=DEFAULT_LOCALE):
+        results = await self.search_batch(terms, search_type, locale=locale)
+        return {term: len(rows) for term, rows in results.items()}
+
+    async def fetch_batch(self, terms, search_type="broad", locale=DEFAULT_LOCALE):
+        """All the `terms` of a batch are searched in the one `locale` table."""
+        result = None
+        is_error = True
+
+        try:
+            result = await self.query_batch(terms, search_type, locale)
+            is_error = False
+        except Exception as error:
+            logger.error(str(error))
+
+        return result, is_error
+
+
+class PostgresShardedBackend(Backend):
+    """Fans out to every shard of DB_SHARDS, `pool_size` connections per shard."""
+
+    def __init__(self, pool_size, shards=None, **kwargs):
+        super().__init__(pool_size)
+        self.shards = shards
+        self.pool = None
+
+    async def connect(self):
+        self.pool = await create_sharded_pool(
+            min_size=min(50, self.pool_size), max_size=self.pool_size, shards=self.shards
+        )
+
+    async def search(self, term, search_type="broad", total_keywords=1000, locale=DEFAULT_LOCALE):
+        with span("pg.shards.query"):
+            results = await self.pool.run(
+                search_keywords, term, COLUMNS, search_type, total_keywords, locale
+            )
+        return [(r["keyword"], r["volume"]) for r in merge_top(results, total_keywords)]
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+
+
+class ElasticsearchBackend(Backend):
+    def __init__(self, pool_size, **kwargs):
+        super().__init__(pool_size)
+        self.es_client = None
+
+    async def connect(self):
+        self.es_client = create_es_client(maxsize=self.pool_size)
+
+    async def search(self, term, search_type="broad", total_keywords=1000, locale=DEFAULT_LOCALE):
+        keywords, volumes = await search_keywords_lean(
+            self.es_client, term, search_type, total_keywords, index=locale.name
+        )
+        return list(zip(keywords, volumes))
+
+    async def query(self, term, search_type="broad", locale=DEFAULT_LOCALE):
+        keywords, _ = await search_keywords_lean(
+            self.es_client, term, search_type, index=locale.name
+        )
+        return len(keywords)
+
+    async def close(self):
+        if self.es_client is not None:
+            await self.es_client.close()
+
+
+class ElasticsearchHedgedBackend(ElasticsearchBackend):
+    """Routes over the ELASTICSEARCH_HOSTS nodes by latency, hedging slow searches."""
+
+    async def connect(self):
+        self.es_client = create_hedged_client(client_kwargs={"maxsize": self.pool_size})
+
+    async def close(self):
+        if self.es_client is not None:
+            logger.info(f"Hedging stats: {self.es_client.stats}, nodes: {self.es_client.node_stats()}")
+            await self.es_client.close()
+
+
+class MemoryBackend(Backend):
+    """The in memory corpus only has the default locale's keywords."""
+
+    def __init__(self, pool_size, **kwargs):
+        super().__init__(pool_size)
+        self.index = None
+
+    async def connect(self):
+        self.index = load_index()
+
+    async def search(self, term, search_type="broad", total_keywords=1000, locale=DEFAULT_LOCALE):
+        if locale != DEFAULT_LOCALE:
+            raise ValueError(f"No in memory index for {locale.name}")
+        with span("memory.search"):
+            doc_ids = self.index.search(term, search_type, total_keywords)
+        return [(self.index.keywords[d], int(self.index.volumes[d])) for d in doc_ids]
+
+
+BACKENDS = {
+    "postgresql": PostgresBackend,
+    "postgresql_batch": PostgresBatchBackend,
+    "postgresql_sharded": PostgresShardedBackend,
+    "elastic_search": ElasticsearchBackend,
+    "elastic_search_hedged": ElasticsearchHedgedBackend,
+    "memory": MemoryBackend,
+}
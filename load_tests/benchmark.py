@@ -0,0 +1,118 @@
+import argparse
+import asyncio
+import logging
+import time
+
+import pandas as pd
+
+from histogram import LatencyHistogram
+from load_tests.adwords_load_test import (
+    collect_open_loop,
+    collect_results,
+    load_type_config,
+    read_search_queries,
+    sources,
+    upload_to_s3,
+)
+
+logger = logging.getLogger(__name__)
+
+
+async def benchmark_source(source, queries, load_type, mode, batch_size, rate, duration, ramp_to):
+    queries_to_run = load_type_config.get(load_type)
+
+    t1 = time.perf_counter()
+    if mode == "open_loop":
+        result = await collect_open_loop(
+            source, queries, queries_to_run, rate, duration, ramp_to
+        )
+        histogram = result.histogram
+        errors = sum(row["errors"] for row in result.timeline_rows())
+    else:
+        results = await collect_results(source, queries, queries_to_run, batch_size)
+        histogram = LatencyHistogram()
+        for r in results:
+            if not r["error"]:
+                histogram.record(r["time_took"])
+        errors = sum(1 for r in results if r["error"])
+    elapsed = time.perf_counter() - t1
+
+    return dict(
+        source=source,
+        requests=histogram.count + errors,
+        errors=errors,
+        requests_per_sec=(histogram.count + errors) / elapsed,
+        **histogram.summary(),
+    )
+
+
+async def benchmark(source_names, load_type, mode, batch_size, rate, duration, ramp_to):
+    """
+    Runs the same topics.json workload against every source, one after the
+    other, every query routed to its own locale.
+    """
+    queries = read_search_queries()
+
+    rows = []
+    for source in source_names:
+        logger.info(f"Benchmarking source: {source}, load_type: {load_type}, mode: {mode}")
+        rows.append(
+            await benchmark_source(
+                source, queries, load_type, mode, batch_size, rate, duration, ramp_to
+            )
+        )
+
+    df = pd.DataFrame(rows)
+    print(df.to_string(index=False))
+
+    file_name = f"benchmark_{load_type}_{mode}.csv"
+    df.to_csv(file_name, index=False)
+    upload_to_s3([file_name])
+
+
+def cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--sources",
+        nargs="+",
+        help="Sources to compare",
+        default=["postgresql", "elastic_search", "memory"],
+        choices=list(sources),
+    )
+    parser.add_argument(
+        "--load_type",
+        type=str,
+        help="Load testing type",
+        default="test",
+        choices=list(load_type_config),
+    )
+    parser.add_argument(
+        "--mode",
+        type=str,
+        help="closed_loop runs chunks of load_type queries, open_loop sends at a fixed rate",
+        default="closed_loop",
+        choices=["closed_loop", "open_loop"],
+    )
+    parser.add_argument("--batch_size", type=int, help="Terms per statement for batch sources", default=50)
+    parser.add_argument("--rate", type=float, help="Open loop requests/sec", default=100)
+    parser.add_argument("--ramp_to", type=float, help="Open loop requests/sec at the end", default=None)
+    parser.add_argument("--duration", type=float, help="Open loop seconds", default=60)
+    args = parser.parse_args()
+    asyncio.run(
+        benchmark(
+            args.sources,
+            args.load_type,
+            args.mode,
+            args.batch_size,
+            args.rate,
+            args.duration,
+            args.ramp_to,
+        )
+    )
+
+
+if __name__ == "__main__":
+    """
+    python -m load_tests.benchmark --sources postgresql elastic_search memory --load_type small
+    """
+    cli()
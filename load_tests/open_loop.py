@@ -0,0 +1,102 @@
+import asyncio
+import itertools
+import logging
+from collections import defaultdict
+
+from histogram import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+
+def arrival_times(rate, duration, ramp_to=None):
+    """
+    Intended send times, in seconds from the start, for `rate` requests/sec
+    ramped linearly to `ramp_to` requests/sec over `duration` seconds.
+    """
+    ramp_to = rate if ramp_to is None else ramp_to
+    t = 0.0
+    while t < duration:
+        yield t
+        t += 1 / (rate + (ramp_to - rate) * t / duration)
+
+
+class OpenLoopResult:
+    def __init__(self):
+        self.histogram = LatencyHistogram()
+        self.timeline = defaultdict(lambda: {"sent": 0, "completed": 0, "errors": 0})
+
+    def record(self, sent_second, completed_second, latency, is_error):
+        self.timeline[sent_second]["sent"] += 1
+        self.timeline[completed_second]["completed"] += 1
+        if is_error:
+            self.timeline[completed_second]["errors"] += 1
+        else:
+            self.histogram.record(latency)
+
+    def merge(self, other):
+        self.histogram.merge(other.histogram)
+        for second, counters in other.timeline.items():
+            for name, value in counters.items():
+                self.timeline[second][name] += value
+        return self
+
+    def to_dict(self):
+        return {"histogram": self.histogram.to_dict(), "timeline": self.timeline_rows()}
+
+    @classmethod
+    def from_dict(cls, data):
+        result = cls()
+        result.histogram = LatencyHistogram.from_dict(data["histogram"])
+        for row in data["timeline"]:
+            row = dict(row)
+            result.timeline[row.pop("second")].update(row)
+        return result
+
+    def timeline_rows(self):
+        return [
+            dict(second=second, **self.timeline[second])
+            for second in sorted(self.timeline)
+        ]
+
+
+async def run_open_loop(fetch, queries, rate, duration, ramp_to=None):
+    """
+    Calls `fetch(query)` at a fixed (or ramped) arrival rate, without waiting
+    for earlier requests. Latency is measured from the intended send time, so
+    queueing delay in the client or the backend is part of it.
+
+    `fetch` returns a `time_tracker` tuple, its third item is the error flag.
+    """
+    loop = asyncio.get_running_loop()
+    result = OpenLoopResult()
+    started_at = loop.time()
+    tasks = set()
+
+    async def _request(query, intended_at):
+        is_error = True
+        try:
+            is_error = (await fetch(query))[2]
+        except Exception as error:
+            logger.error(str(error))
+        completed_at = loop.time()
+        result.record(
+            int(intended_at - started_at),
+            int(completed_at - started_at),
+            completed_at - intended_at,
+            is_error,
+        )
+
+    for query, offset in zip(itertools.cycle(queries), arrival_times(rate, duration, ramp_to)):
+        intended_at = started_at + offset
+        delay = intended_at - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        task = asyncio.create_task(_request(query, intended_at))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    if tasks:
+        await asyncio.gather(*tasks)
+
+    return result
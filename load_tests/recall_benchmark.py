@@ -0,0 +1,176 @@
+import argparse
+import asyncio
+import csv
+import logging
+import os.path
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from histogram import LatencyHistogram
+from load_tests.adwords_load_test import Query, create_backend, sources
+from locales import DEFAULT_LOCALE
+from utils import TERMS
+
+logger = logging.getLogger(__name__)
+
+ROOT_PATH = Path(__file__).parent.parent
+OUTPUT_PATH = os.path.join(Path(__file__).parent, "output")
+
+BASELINE_FOLDER = "bigquery"
+CHECKED_IN_FOLDERS = ["postgres", "elastic", "elastic_local"]
+PROJECT_SEARCH_TYPES = {"papi": ["broad"], "dapi": ["phrase", "broad"]}
+
+
+def result_file_path(folder, project, term, search_type):
+    file_name = f"{term}_{search_type}" if project == "dapi" else term
+    return os.path.join(ROOT_PATH, folder, project, f"{file_name}.csv")
+
+
+def parse_volume(value):
+    # BigQuery exports a missing volume as nan
+    volume = float(value or 0)
+    return 0 if volume != volume else int(volume)
+
+
+def read_result(folder, project, term, search_type):
+    file_path = result_file_path(folder, project, term, search_type)
+    if not os.path.exists(file_path):
+        return None
+
+    with open(file_path, mode="r") as f:
+        return [(row["keyword"], parse_volume(row["volume"])) for row in csv.DictReader(f)]
+
+
+def overlap_at_k(result, baseline, k):
+    expected = {keyword for keyword, _ in baseline[:k]}
+    if not expected:
+        return None
+    return len({keyword for keyword, _ in result[:k]} & expected) / len(expected)
+
+
+def rank_correlation(result, baseline):
+    """Spearman correlation between both rankings of the keywords they share."""
+    result_ranks = {keyword: rank for rank, (keyword, _) in enumerate(result)}
+    shared = [result_ranks[keyword] for keyword, _ in baseline if keyword in result_ranks]
+    n = len(shared)
+    if n < 2:
+        return None
+
+    ranks = {result_rank: rank for rank, result_rank in enumerate(sorted(shared))}
+    d_squared = sum((rank - ranks[result_rank]) ** 2 for rank, result_rank in enumerate(shared))
+    return 1 - 6 * d_squared / (n * (n * n - 1))
+
+
+def volume_weighted_recall(result, baseline):
+    total_volume = sum(volume for _, volume in baseline)
+    if not total_volume:
+        return None
+
+    found = {keyword for keyword, _ in result}
+    return sum(volume for keyword, volume in baseline if keyword in found) / total_volume
+
+
+def compare(source, project, term, search_type, result, baseline, k_values):
+    row = dict(
+        source=source,
+        project=project,
+        term=term,
+        search_type=search_type,
+        results=len(result),
+        baseline_results=len(baseline),
+        rank_correlation=rank_correlation(result, baseline),
+        volume_weighted_recall=volume_weighted_recall(result, baseline),
+    )
+    for k in k_values:
+        row[f"overlap@{k}"] = overlap_at_k(result, baseline, k)
+    return row
+
+
+def search_cases():
+    for project, search_types in PROJECT_SEARCH_TYPES.items():
+        for term in [term for terms in TERMS.values() for term in terms]:
+            for search_type in search_types:
+                baseline = read_result(BASELINE_FOLDER, project, term, search_type)
+                if baseline is not None:
+                    yield project, term, search_type, baseline
+
+
+async def benchmark_source(source, k_values, total_keywords=1000):
+    """Re-runs the TERMS queries against a live source, timing every search."""
+    rows = []
+    histogram = LatencyHistogram()
+    queries = [Query(term, DEFAULT_LOCALE) for terms in TERMS.values() for term in terms]
+    backend = await create_backend(source, 1, queries)
+    try:
+        for project, term, search_type, baseline in search_cases():
+            t1 = time.perf_counter()
+            result = await backend.search(term, search_type, total_keywords)
+            histogram.record(time.perf_counter() - t1)
+            rows.append(compare(source, project, term, search_type, result, baseline, k_values))
+    finally:
+        await backend.close()
+
+    return rows, histogram
+
+
+def benchmark_checked_in(folder, k_values):
+    rows = []
+    for project, term, search_type, baseline in search_cases():
+        result = read_result(folder, project, term, search_type)
+        if result is not None:
+            rows.append(compare(folder, project, term, search_type, result, baseline, k_values))
+    return rows
+
+
+async def benchmark(source_names, folders, k_values):
+    rows = []
+    latencies = {}
+    for source in source_names:
+        logger.info(f"Benchmarking source: {source}")
+        source_rows, histogram = await benchmark_source(source, k_values)
+        rows.extend(source_rows)
+        latencies[source] = histogram.summary()
+
+    for folder in folders:
+        rows.extend(benchmark_checked_in(folder, k_values))
+
+    df = pd.DataFrame(rows)
+    metrics = ["rank_correlation", "volume_weighted_recall"] + [f"overlap@{k}" for k in k_values]
+    summary = df.groupby(["source", "project", "search_type"])[metrics].mean().reset_index()
+    for name in ["p50", "p90", "p99", "p99.9"]:
+        summary[f"{name}_ms"] = summary["source"].map(
+            lambda source: latencies.get(source, {}).get(name)
+        )
+
+    print(summary.to_string(index=False))
+    df.to_csv(os.path.join(OUTPUT_PATH, "recall_benchmark.csv"), index=False)
+    summary.to_csv(os.path.join(OUTPUT_PATH, "recall_benchmark_summary.csv"), index=False)
+
+
+def cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--sources",
+        nargs="*",
+        help="Live sources to re-run the TERMS queries against",
+        default=[],
+        choices=list(sources),
+    )
+    parser.add_argument(
+        "--checked_in",
+        nargs="*",
+        help="Checked in result folders to compare",
+        default=CHECKED_IN_FOLDERS,
+    )
+    parser.add_argument("--k", nargs="+", type=int, help="Overlap cut offs", default=[10, 100, 1000])
+    args = parser.parse_args()
+    asyncio.run(benchmark(args.sources, args.checked_in, args.k))
+
+
+if __name__ == "__main__":
+    """
+    python -m load_tests.recall_benchmark --sources postgresql memory --checked_in postgres elastic
+    """
+    cli()
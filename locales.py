@@ -0,0 +1,60 @@
+import re
+from typing import NamedTuple
+
+# Languages with a postgres text search config and an elasticsearch analyzer
+# of the same name, others fall back to no stemming or stop words
+LANGUAGES = {
+    "da": "danish",
+    "de": "german",
+    "en": "english",
+    "es": "spanish",
+    "fi": "finnish",
+    "fr": "french",
+    "hu": "hungarian",
+    "it": "italian",
+    "nl": "dutch",
+    "no": "norwegian",
+    "pt": "portuguese",
+    "ro": "romanian",
+    "ru": "russian",
+    "sv": "swedish",
+    "tr": "turkish",
+}
+
+CODE_PATTERN = re.compile(r"^[a-z]{2}$")
+
+
+class Locale(NamedTuple):
+    language: str
+    country: str
+
+    @property
+    def name(self):
+        """Table and index alias name, e.g. adwords_en_us."""
+        return f"adwords_{self.language}_{self.country}"
+
+    @property
+    def text_search_config(self):
+        return LANGUAGES.get(self.language, "simple")
+
+    @property
+    def analyzer(self):
+        return LANGUAGES.get(self.language, "standard")
+
+
+DEFAULT_LOCALE = Locale("en", "us")
+
+
+def locale_for(country=None, language=None):
+    """
+    Locale of a request from its country and language (ISO 3166 / 639-1 codes),
+    each defaulting to DEFAULT_LOCALE's. The codes end up in table and index
+    names, so anything but two letters is rejected.
+    """
+    language = (language or DEFAULT_LOCALE.language).strip().lower()
+    country = (country or DEFAULT_LOCALE.country).strip().lower()
+    for code in (language, country):
+        if not CODE_PATTERN.match(code):
+            raise ValueError(f"Invalid locale code: {code!r}")
+
+    return Locale(language, country)
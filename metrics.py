@@ -0,0 +1,157 @@
+import asyncio
+import json
+import re
+import time
+from collections import defaultdict
+
+from histogram import LatencyHistogram
+
+SNAPSHOT_PERCENTILES = (50, 90, 99, 99.9)
+
+
+class Span:
+    __slots__ = ("metrics", "name", "started_at")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.metrics.active[self.name] += 1
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.active[self.name] -= 1
+        self.metrics.observe(self.name, time.perf_counter() - self.started_at)
+        if exc_type is not None:
+            self.metrics.errors[self.name] += 1
+
+
+class Metrics:
+    """
+    Per stage latency histograms, in flight and error counts, and gauges read
+    at snapshot time. Stages are named `<backend>.<stage>`, e.g. `pg.acquire`.
+    """
+
+    def __init__(self):
+        self.histograms = defaultdict(LatencyHistogram)
+        self.active = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.gauges = {}
+
+    def span(self, name):
+        """Times the `with` block into the `name` histogram, usable around awaits."""
+        return Span(self, name)
+
+    def observe(self, name, seconds):
+        self.histograms[name].record(seconds)
+
+    def register_gauge(self, name, fn, **labels):
+        """`fn()` is called for the gauge value on every snapshot."""
+        self.gauges[(name, tuple(sorted(labels.items())))] = fn
+
+    def unregister_gauges(self, **labels):
+        """Removes the gauges having all of `labels`."""
+        if not labels:
+            raise ValueError("At least one label is required")
+        for key in [key for key in self.gauges if set(labels.items()) <= set(key[1])]:
+            del self.gauges[key]
+
+    def reset(self):
+        self.histograms.clear()
+        self.errors.clear()
+
+    def snapshot(self):
+        return {
+            "stages": {
+                name: {
+                    **histogram.summary(SNAPSHOT_PERCENTILES),
+                    "active": self.active[name],
+                    "errors": self.errors[name],
+                    "total_ms": histogram.total / 1000,
+                }
+                for name, histogram in sorted(self.histograms.items())
+            },
+            "gauges": [
+                {"name": name, "labels": dict(labels), "value": fn()}
+                for (name, labels), fn in sorted(self.gauges.items())
+            ],
+        }
+
+    def to_json(self):
+        return json.dumps(self.snapshot())
+
+    def to_prometheus(self):
+        lines = [
+            "# TYPE fetcher_stage_seconds summary",
+        ]
+        for name, histogram in sorted(self.histograms.items()):
+            for percentile in SNAPSHOT_PERCENTILES:
+                value = histogram.percentile(percentile) / 1_000_000
+                lines.append(
+                    f'fetcher_stage_seconds{{stage="{name}",quantile="{percentile / 100:g}"}} {value}'
+                )
+            lines.append(f'fetcher_stage_seconds_sum{{stage="{name}"}} {histogram.total / 1_000_000}')
+            lines.append(f'fetcher_stage_seconds_count{{stage="{name}"}} {histogram.count}')
+
+        lines.append("# TYPE fetcher_stage_active gauge")
+        for name in sorted(self.histograms):
+            lines.append(f'fetcher_stage_active{{stage="{name}"}} {self.active[name]}')
+        lines.append("# TYPE fetcher_stage_errors_total counter")
+        for name in sorted(self.histograms):
+            lines.append(f'fetcher_stage_errors_total{{stage="{name}"}} {self.errors[name]}')
+
+        for (name, labels), fn in sorted(self.gauges.items()):
+            metric = "fetcher_" + re.sub(r"[^a-zA-Z0-9_]", "_", name)
+            label_text = ",".join(f'{key}="{value}"' for key, value in labels)
+            lines.append(f"{metric}{{{label_text}}} {fn()}")
+
+        return "\n".join(lines) + "\n"
+
+    async def serve(self, host="0.0.0.0", port=9108):
+        """
+        Serves `/metrics` in prometheus text format and `/metrics.json` as a
+        json snapshot, returns the asyncio server.
+        """
+
+        async def _handle(reader, writer):
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+
+            path = request_line.split(b" ")[1] if request_line.count(b" ") >= 2 else b"/"
+            if path == b"/metrics.json":
+                status, content_type, body = "200 OK", "application/json", self.to_json()
+            elif path == b"/metrics":
+                status, content_type, body = "200 OK", "text/plain; version=0.0.4", self.to_prometheus()
+            else:
+                status, content_type, body = "404 Not Found", "text/plain", "Not found\n"
+
+            body = body.encode("utf-8")
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("utf-8")
+                + body
+            )
+            await writer.drain()
+            writer.close()
+
+        return await asyncio.start_server(_handle, host, port)
+
+
+METRICS = Metrics()
+
+
+def span(name):
+    return METRICS.span(name)
+
+
+def register_pool_gauges(pool, name, metrics=METRICS):
+    """Size, idle and in use connections of an asyncpg pool, labelled with `name`."""
+    metrics.register_gauge("pg.pool.size", pool.get_size, pool=name)
+    metrics.register_gauge("pg.pool.max_size", pool.get_max_size, pool=name)
+    metrics.register_gauge("pg.pool.idle", pool.get_idle_size, pool=name)
+    metrics.register_gauge(
+        "pg.pool.in_use", lambda: pool.get_size() - pool.get_idle_size(), pool=name
+    )
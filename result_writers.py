@@ -0,0 +1,219 @@
+import asyncio
+import csv
+import json
+import os
+import struct
+import zlib
+
+import numpy as np
+
+COLUMNAR_MAGIC = b"KWCOL1"
+
+# A column's file type is the widest of its row groups' types
+COLUMN_TYPE_RANKS = {"int64": 0, "float64": 1, "utf8": 2}
+
+
+class CsvWriter:
+    extension = "csv"
+
+    def __init__(self, file_path, columns=None):
+        self.f = open(file_path, "w", newline="")
+        self.columns = columns
+        self.writer = None
+        if columns is not None:
+            self._write_header(columns)
+
+    def _write_header(self, columns):
+        self.writer = csv.DictWriter(self.f, fieldnames=columns)
+        self.writer.writeheader()
+
+    def write_rows(self, rows):
+        if self.writer is None:
+            self._write_header(list(rows[0].keys()))
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.f.close()
+
+
+class JsonLinesWriter:
+    extension = "jsonl"
+
+    def __init__(self, file_path, columns=None):
+        self.f = open(file_path, "w")
+
+    def write_rows(self, rows):
+        self.f.write("".join(json.dumps(row, default=str) + "\n" for row in rows))
+
+    def close(self):
+        self.f.close()
+
+
+class ColumnarWriter:
+    """
+    Compressed binary column file. Each batch is a row group with one zlib
+    compressed block per column, the schema and block offsets are written in a
+    json footer at the end of the file, so rows can be appended while streaming.
+    Column types are inferred per row group, an int column with a float in a
+    later batch is float64 from that row group on.
+
+    Layout: magic, blocks..., footer json, footer length (uint64), magic
+    """
+
+    extension = "kwcol"
+
+    def __init__(self, file_path, columns=None):
+        self.f = open(file_path, "wb")
+        self.f.write(COLUMNAR_MAGIC)
+        self.columns = columns
+        self.types = None
+        self.row_groups = []
+
+    @staticmethod
+    def _column_type(values):
+        """int64, float64 if any value is a float, utf8 if any isn't a number, None if all are None."""
+        column_type = None
+        for value in values:
+            if value is None:
+                continue
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                return "utf8"
+            if isinstance(value, float):
+                column_type = "float64"
+            elif column_type is None:
+                column_type = "int64"
+        return column_type
+
+    @staticmethod
+    def _widen(column_type, other):
+        if column_type is None or other is None:
+            return column_type or other
+        return max(column_type, other, key=COLUMN_TYPE_RANKS.get)
+
+    @staticmethod
+    def _encode(values, column_type):
+        validity = bytes(v is not None for v in values)
+        if column_type == "utf8":
+            data = [("" if v is None else str(v)).encode("utf-8") for v in values]
+            offsets = np.cumsum([0] + [len(d) for d in data], dtype=np.int64)
+            payload = offsets.tobytes() + b"".join(data)
+        else:
+            payload = np.array(
+                [0 if v is None else v for v in values], dtype=column_type
+            ).tobytes()
+        return zlib.compress(validity + payload)
+
+    def write_rows(self, rows):
+        if self.columns is None:
+            self.columns = list(rows[0].keys())
+        if self.types is None:
+            self.types = [None] * len(self.columns)
+
+        blocks = []
+        types = []
+        for i, col in enumerate(self.columns):
+            values = [r.get(col) for r in rows]
+            inferred = self._column_type(values)
+            self.types[i] = self._widen(self.types[i], inferred)
+            # A row group of only None has no type of its own
+            column_type = inferred or self.types[i] or "utf8"
+            block = self._encode(values, column_type)
+            blocks.append([self.f.tell(), len(block)])
+            types.append(column_type)
+            self.f.write(block)
+        self.row_groups.append({"rows": len(rows), "types": types, "blocks": blocks})
+
+    def close(self):
+        footer = json.dumps(
+            {
+                "columns": self.columns or [],
+                "types": [t or "utf8" for t in self.types or [None] * len(self.columns or [])],
+                "row_groups": self.row_groups,
+            }
+        ).encode("utf-8")
+        self.f.write(footer)
+        self.f.write(struct.pack("<Q", len(footer)))
+        self.f.write(COLUMNAR_MAGIC)
+        self.f.close()
+
+
+def read_columnar(file_path):
+    """Reads a column file back as {column: list of values}."""
+    with open(file_path, "rb") as f:
+        data = f.read()
+
+    footer_length = struct.unpack("<Q", data[-len(COLUMNAR_MAGIC) - 8 : -len(COLUMNAR_MAGIC)])[0]
+    footer_end = len(data) - len(COLUMNAR_MAGIC) - 8
+    footer = json.loads(data[footer_end - footer_length : footer_end])
+
+    result = {col: [] for col in footer["columns"]}
+    for row_group in footer["row_groups"]:
+        n = row_group["rows"]
+        for col, column_type, (offset, length) in zip(
+            footer["columns"], row_group.get("types", footer["types"]), row_group["blocks"]
+        ):
+            block = zlib.decompress(data[offset : offset + length])
+            validity, payload = block[:n], block[n:]
+            if column_type == "utf8":
+                offsets = np.frombuffer(payload[: (n + 1) * 8], dtype=np.int64)
+                blob = payload[(n + 1) * 8 :]
+                values = [
+                    blob[offsets[i] : offsets[i + 1]].decode("utf-8") for i in range(n)
+                ]
+            else:
+                values = np.frombuffer(payload, dtype=column_type).tolist()
+            result[col].extend(v if valid else None for v, valid in zip(values, validity))
+
+    return result
+
+
+WRITERS = {
+    "csv": CsvWriter,
+    "jsonl": JsonLinesWriter,
+    "columnar": ColumnarWriter,
+}
+
+
+def file_path_for(file_name, format="csv"):
+    return os.path.join(os.path.dirname(__file__), f"{file_name}.{WRITERS[format].extension}")
+
+
+async def iterate_batches(records, batch_size):
+    """Batches of dicts from an (async) iterable of dicts or lists of dicts."""
+    if not hasattr(records, "__aiter__"):
+        records = _aiter(records)
+
+    batch = []
+    async for item in records:
+        if isinstance(item, dict):
+            batch.append(item)
+        else:
+            batch.extend(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def _aiter(records):
+    for record in records:
+        yield record
+
+
+async def write_records(records, file_name, format="csv", columns=None, batch_size=1000):
+    """
+    Writes records to `<file_name>.<extension>` as they arrive. Opening,
+    writing and closing the file run in a worker thread, so many outputs can
+    be written concurrently without blocking the event loop.
+    """
+    writer = await asyncio.to_thread(WRITERS[format], file_path_for(file_name, format), columns)
+    rows = 0
+    try:
+        async for batch in iterate_batches(records, batch_size):
+            await asyncio.to_thread(writer.write_rows, batch)
+            rows += len(batch)
+    finally:
+        await asyncio.to_thread(writer.close)
+
+    return rows
@@ -0,0 +1,78 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+
+class SearchCache:
+    """
+    LRU cache with ttl for search results. Concurrent misses for the same key
+    share one backend call. Cached results are shared, callers must not modify them.
+    """
+
+    def __init__(self, max_size=10000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0}
+
+        self._entries = OrderedDict()
+        self._in_flight = {}
+
+    @staticmethod
+    def make_key(term, search_type, columns, total_keywords, locale=None):
+        return (
+            " ".join(term.lower().split()),
+            search_type,
+            tuple(columns),
+            total_keywords,
+            locale,
+        )
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def get_or_fetch(self, key, fetch):
+        """
+        The backend call runs in a task shared by every caller of the key, so
+        it outlives any one of them being cancelled.
+        """
+        value = self.get(key)
+        if value is not None:
+            self.stats["hits"] += 1
+            return value
+
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.stats["coalesced"] += 1
+        else:
+            self.stats["misses"] += 1
+            task = asyncio.ensure_future(fetch())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._fetched(key, done))
+
+        return await asyncio.shield(task)
+
+    def _fetched(self, key, task):
+        # Runs before the callers are woken up, so they see the cached value
+        del self._in_flight[key]
+        # Retrieve the exception, so a miss nobody waited on anymore doesn't warn
+        if not task.cancelled() and task.exception() is None:
+            self.set(key, task.result())
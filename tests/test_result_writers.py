@@ -0,0 +1,49 @@
+from result_writers import ColumnarWriter, read_columnar
+
+
+def write_columnar(file_path, batches, columns=None):
+    writer = ColumnarWriter(file_path, columns)
+    for rows in batches:
+        writer.write_rows(rows)
+    writer.close()
+    return read_columnar(file_path)
+
+
+def test_columnar_round_trip(tmp_path):
+    rows = [
+        {"keyword": "nfl scores", "volume": 20400000, "cpc": 0.5},
+        {"keyword": "nfl scores today", "volume": 1000, "cpc": None},
+        {"keyword": "ñandú", "volume": None, "cpc": 1.25},
+    ]
+
+    result = write_columnar(tmp_path / "rows.kwcol", [rows[:2], rows[2:]])
+
+    assert result == {
+        "keyword": ["nfl scores", "nfl scores today", "ñandú"],
+        "volume": [20400000, 1000, None],
+        "cpc": [0.5, None, 1.25],
+    }
+
+
+def test_columnar_widens_ints_to_floats(tmp_path):
+    result = write_columnar(
+        tmp_path / "cpc.kwcol",
+        [[{"cpc": 0}], [{"cpc": 1.75}], [{"cpc": 0}, {"cpc": 0.5}]],
+    )
+
+    assert result == {"cpc": [0, 1.75, 0, 0.5]}
+
+
+def test_columnar_mixed_types_as_text(tmp_path):
+    result = write_columnar(
+        tmp_path / "mixed.kwcol", [[{"value": None}], [{"value": 1}, {"value": "a"}]]
+    )
+
+    assert result == {"value": [None, "1", "a"]}
+
+
+def test_columnar_empty(tmp_path):
+    assert write_columnar(tmp_path / "empty.kwcol", [], ["keyword", "volume"]) == {
+        "keyword": [],
+        "volume": [],
+    }
@@ -1,5 +1,4 @@
-import csv
-import os
+from result_writers import CsvWriter, file_path_for
 
 TERMS = {
     "singe_word_terms": ["moneycard", "walmart", "keyword"],
@@ -18,12 +17,9 @@ def print_result(result):
     print("\n")
 
 
-def write_to_file(file_name, result):
-    file_path = os.path.join(os.path.dirname(__file__), f"{file_name}.csv")
-    with open(file_path, "w") as f:
-        fieldnames = result[0].keys()
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writeheader()
-
-        for r in result:
-            writer.writerow(r)
+def write_to_file(file_name, result, columns=None):
+    """Blocking csv write, coroutines should use result_writers.write_records."""
+    writer = CsvWriter(file_path_for(file_name), columns)
+    if result:
+        writer.write_rows(result)
+    writer.close()